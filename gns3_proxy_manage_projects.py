@@ -11,17 +11,21 @@
 
 import argparse
 import configparser
+import itertools
 import json
 import logging
 import re
 import sys
 import os
 import time
-import shutil
-import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from ipaddress import ip_address
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
 
 VERSION = (0, 3)
 __version__ = '.'.join(map(str, VERSION[0:2]))
@@ -34,6 +38,17 @@ __license__ = 'BSD'
 
 logger = logging.getLogger(__name__)
 
+# serializes console output of servers handled concurrently
+print_lock = threading.Lock()
+
+# set on Ctrl-C to stop the workers still running, as they are not waited for
+stop_event = threading.Event()
+
+# UUID4 as used by GNS3 for new project ids
+UUID4_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}', re.IGNORECASE)
+# UUID of any version, GNS3 accepts all of them as ids of existing projects
+UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE)
+
 PY3 = sys.version_info[0] == 3
 
 if PY3:  # pragma: no cover
@@ -59,11 +74,87 @@ DEFAULT_INCLUDE_BASE_IMAGES = False
 DEFAULT_INCLUDE_SNAPSHOTS = False
 DEFAULT_RESET_MAC_ADDRESSES = False
 
+# Number of duplicate requests sent concurrently to a single server
+DUPLICATE_WORKERS = 8
+
+# Number of project exports streamed concurrently from a single server
+EXPORT_WORKERS = 4
+
+# Buffer size used to write exported projects to disk
+EXPORT_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+# Project actions consisting only of plain API calls. Each step is a tuple of
+# (HTTP method, URL suffix relative to the project, accepted status codes, allow 404, error message).
+PROJECT_ACTIONS = {
+    'delete': [('POST', '/close', {201, 204}, True, "Unable to close project."),
+               ('DELETE', '', {204}, True, "unable to delete project")],
+    'start': [('POST', '/open', {201}, False, "Unable to open project on target server."),
+              ('POST', '/nodes/start', {204}, False, "Unable to start project on target server.")],
+    'stop': [('POST', '/nodes/stop', {204}, False, "Unable to stop project on target server."),
+             ('POST', '/close', {201, 204}, False, "Unable to close project. Project does not exist or is corrupted?")],
+}
+
 
 class ProxyError(Exception):
     pass
 
 
+def _expect(r, ok, error_msg, allow_404=False):
+    """Check the status code of a GNS3 API response.
+
+    Returns True if the status code is one of ``ok``. If ``allow_404`` is set, a missing resource is not treated as an
+    error and False is returned. Otherwise ``error_msg`` is logged and ProxyError is raised."""
+    status_code = r.status_code
+    if status_code in ok:
+        return True
+    if allow_404 and status_code == 404:
+        logger.debug("Not found: %s, skipping", r.url)
+        return False
+    logger.fatal(error_msg)
+    logger.debug("HTTP %d on %s Text: %s", status_code, r.url, r.text[:200])
+    raise ProxyError()
+
+
+def run_project_action(action, project_url, session):
+    """Run the API calls of a PROJECT_ACTIONS entry against the project at project_url."""
+    for method, suffix, ok, allow_404, error_msg in PROJECT_ACTIONS[action]:
+        logger.debug("%s %s%s", method, project_url, suffix)
+        data = "{}" if method == 'POST' else None
+        r = session.request(method, project_url + suffix, data=data)
+        _expect(r, ok, error_msg, allow_404=allow_404)
+
+
+def synchronized_print(message):
+    """Print a message without interleaving it with output of other threads."""
+    with print_lock:
+        print(message)
+
+
+def check_stopped():
+    """Raise ProxyError if the run was interrupted, called by workers between API calls and transferred chunks."""
+    if stop_event.is_set():
+        raise ProxyError()
+
+
+@contextmanager
+def interruptible_executor(max_workers):
+    """Provide a ThreadPoolExecutor that is shut down like in a with statement, unless Ctrl-C was pressed.
+
+    On Ctrl-C running workers are not waited for, stop_event is set instead to let them and the workers not
+    started yet stop at their next check_stopped()."""
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    interrupted = False
+    try:
+        yield executor
+    except KeyboardInterrupt:
+        stop_event.set()
+        interrupted = True
+        raise
+    finally:
+        executor.shutdown(wait=not interrupted)
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser(
         description='gns3_proxy_manage_projects.py v%s Manage projects on GNS3 proxy backends.' % __version__,
@@ -131,58 +222,217 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
+def export_project(server, project, project_url, session, args):
+    """Close a project and stream its export to a file in args.export_to_dir."""
+    check_stopped()
+    project_uuid = project['project_id']
+
+    # Closing project
+    logger.debug("Closing project")
+    url = f"{project_url}/close"
+    data = "{}"
+    r = session.post(url, data)
+    _expect(r, {201, 204}, "Unable to close project. Project does not exist or is corrupted?")
+
+    # export project
+    logger.debug("Exporting project")
+    url = f"{project_url}/export"
+    params = {'include_images': 'yes' if args.include_base_images else 'no',
+              'include_snapshots': 'yes' if args.include_snapshots else 'no',
+              'reset_mac_addresses': 'yes' if args.reset_mac_addresses else 'no',
+              'compression': args.compression}
+    r = session.get(url, params=params, stream=True)
+    _expect(r, {200}, "Unable to export project from source server.")
+    r.raw.decode_content = True
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    filename = f"{server}_{project['name']}_{project_uuid}_{timestamp}.{args.compression}"
+    export_path = os.path.join(args.export_to_dir, filename)
+    with open(export_path, 'wb') as export_file:
+        # copy the export chunk by chunk instead of using shutil.copyfileobj to be able to stop it on Ctrl-C
+        for chunk in iter(lambda: r.raw.read(EXPORT_BUFFER_SIZE), b''):
+            check_stopped()
+            export_file.write(chunk)
+        # the position after the copy is the size of the export, no need to stat the file afterwards
+        export_size = export_file.tell()
+    synchronized_print("#### Project %s (%s) exported to file: %s (%s bytes) from server: %s"
+                       % (project['name'], project['project_id'], filename, export_size, server))
+
+
+def process_server(server, server_address, backend_port, session, args, project_name_pattern, duplicate_numbers):
+    """Run the requested action against a single target server."""
+    check_stopped()
+    # build target server API URL
+    base_dst_api_url = f"http://{server_address}:{backend_port}/v2"
+
+    if args.import_from_file:
+        # project id was validated and normalized in main()
+        project_uuid = args.project_id
+
+        logger.debug("Checking if target project exists...")
+        url = f"{base_dst_api_url}/projects/{project_uuid}"
+        r = session.get(url)
+        if r.status_code == 200:
+            logger.debug("Project UUID: %s already exists on server: %s." % (project_uuid, server_address))
+
+            if args.force:
+                # close and delete destination project
+                synchronized_print("Deleting existing project UUID %s on server: %s" % (project_uuid, server_address))
+                run_project_action('delete', f"{base_dst_api_url}/projects/{project_uuid}", session)
+
+            else:
+                logger.fatal("    WARNING: Project UUID: %s already exists on server: %s import failed, use --force to "
+                             "overwrite." % (project_uuid, server_address))
+                return
+
+        logger.debug("Importing project")
+        # import project
+        url = f"{base_dst_api_url}/projects/{project_uuid}/import"
+        with open(args.import_from_file, 'rb') as import_file:
+            # stream the multipart body from disk instead of building it in memory
+            encoder = MultipartEncoder(fields={'file': (os.path.basename(args.import_from_file), import_file,
+                                                        'application/octet-stream')})
+            # the monitor is called for each chunk read from the file, stop the upload on Ctrl-C
+            monitor = MultipartEncoderMonitor(encoder, lambda monitor: check_stopped())
+            r = session.post(url, data=monitor, headers={'Content-Type': monitor.content_type})
+        if r.status_code == 403:
+            logger.fatal("Forbidden to import project on target server.")
+            logger.debug("HTTP %d on %s Text: %s", r.status_code, r.url, r.text[:200])
+            raise ProxyError()
+        _expect(r, {201}, "Unable to import project on target server.")
+        synchronized_print("#### Project %s imported from file: %s on server: %s"
+                           % (project_uuid, args.import_from_file, server))
+    else:
+        projects = list()
+        if args.project_id and not UUID_PATTERN.fullmatch(args.project_id):
+            # GNS3 project ids are UUIDs, no need to ask the server for anything else
+            logger.debug("Project id %s is not a UUID, no project can match" % args.project_id)
+        elif args.project_id:
+            # fetch the project directly instead of listing all projects on the server
+            logger.debug("Fetching target project UUID")
+            url = f"{base_dst_api_url}/projects/{args.project_id}"
+            r = session.get(url)
+            if _expect(r, {200}, "Could not get project.", allow_404=True):
+                project = r.json()
+                logger.debug('matched UUID of: %s' % project)
+                projects.append(project)
+        else:
+            logger.debug("Searching target project UUIDs")
+            url = f"{base_dst_api_url}/projects"
+            r = session.get(url)
+            _expect(r, {200}, "Could not list projects.")
+            project_results = r.json()
+            for project in project_results:
+                if project_name_pattern.fullmatch(project['name']):
+                    logger.debug('matched name of: %s' % project)
+                    projects.append(project)
+
+        if len(projects) == 0:
+            synchronized_print("#### No matching projects found on server: %s" % server)
+
+        if args.export_to_dir:
+            # exports are independent of each other, stream them concurrently
+            with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as executor:
+                futures = [executor.submit(export_project, server, project,
+                                           f"{base_dst_api_url}/projects/{project['project_id']}", session, args)
+                           for project in projects]
+                for future in futures:
+                    future.result()
+
+        for project in projects:
+            check_stopped()
+            project_uuid = project['project_id']
+            project_url = f"{base_dst_api_url}/projects/{project_uuid}"
+            if args.delete:
+                if args.force:
+                    # close and delete destination project
+                    synchronized_print("#### Deleting project UUID %s on server: %s" % (project_uuid, server_address))
+                    run_project_action('delete', project_url, session)
+                else:
+                    synchronized_print("    WARNING: Project UUID %s to delete found on server: %s, use --force"
+                                       " to really remove it." % (project_uuid, server_address))
+
+            if args.duplicate:
+                project_name = project["name"]
+                if args.duplicates_per_target_server > 0:
+                    # continue numbering across projects and servers
+                    numbers = itertools.islice(duplicate_numbers, args.duplicates_per_target_server)
+                else:
+                    numbers = itertools.count(args.duplicate_start)
+                if args.duplicate_name is not None:
+                    duplicate_prefix = args.duplicate_name
+                else:
+                    duplicate_prefix = project_name
+                duplicate_project_names = [duplicate_prefix + str(duplicate_number) for duplicate_number in
+                                           itertools.takewhile(lambda n: n <= args.duplicate_end, numbers)]
+                for duplicate_project_name in duplicate_project_names:
+                    synchronized_print("#### Duplicating project %s (%s) on server: %s, new name: %s"
+                                       % (project_name, project_uuid, server_address, duplicate_project_name))
+
+                # duplicates are independent of each other, request them concurrently
+                url = f"{project_url}/duplicate"
+                with ThreadPoolExecutor(max_workers=DUPLICATE_WORKERS) as executor:
+                    responses = list(executor.map(
+                        lambda name: session.post(url, json.dumps({'name': name,
+                                                                   'reset_mac_addresses': args.reset_mac_addresses})),
+                        duplicate_project_names))
+                for r in responses:
+                    _expect(r, {201}, "Unable to duplicate project on target server.")
+
+            if args.show:
+                synchronized_print("#### Server: %s, Project Name: %s, Project_ID: %s, Status: %s, "
+                                   % (server, project['name'], project['project_id'], project['status']))
+
+            if args.start:
+                synchronized_print("#### Opening and starting project: %s on %s" % (project['project_id'], server))
+                run_project_action('start', project_url, session)
+
+            if args.stop:
+                synchronized_print("#### Stopping and closing project: %s on %s" % (project['project_id'], server))
+                run_project_action('stop', project_url, session)
+
+
 def main():
     # parse arguments
     args = parse_args(sys.argv[1:])
 
     # parse config file gns3_proxy_config.ini
     config = configparser.ConfigParser()
-    config.read_file(open(args.config_file))
-    config.read(args.config_file)
+    with open(args.config_file) as config_file:
+        config.read_file(config_file)
 
     logging.basicConfig(level=getattr(logging, args.log_level),
                         format='%(asctime)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s')
 
+    # read the proxy section once
+    proxy_section = dict(config.items('proxy'))
+
     # get backend_user
     #
     # description: Username to use to access backend GNS3 server
     # default: admin
-    if config.get('proxy', 'backend_user'):
-        backend_user = config.get('proxy', 'backend_user')
-    else:
-        backend_user = "admin"
+    backend_user = proxy_section.get('backend_user') or "admin"
 
     # get backend_password
     #
     # description: Password to use to access backend GNS3 server
     # default: password
-    if config.get('proxy', 'backend_password'):
-        backend_password = config.get('proxy', 'backend_password')
-    else:
-        backend_password = "password"
+    backend_password = proxy_section.get('backend_password') or "password"
 
     # get backend_port
     #
     # description: TCP port to use to access backend GNS3 server
     # default: 3080
-    if config.get('proxy', 'backend_port'):
-        backend_port = config.getint('proxy', 'backend_port')
-    else:
-        backend_port = 3080
+    backend_port = int(proxy_section.get('backend_port') or 3080)
 
     # read servers from config
-    if config.items('servers'):
-        config_servers = dict()
-        server_items = config.items('servers')
+    server_items = config.items('servers')
+    try:
         for server, value in server_items:
-            try:
-                ip_address(value)
-            except ValueError:
-                logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)" % value)
-                raise ProxyError()
-            config_servers[server] = value
-    else:
-        config_servers = None
+            ip_address(value)
+    except ValueError:
+        logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)" % value)
+        raise ProxyError()
+    config_servers = dict(server_items)
 
     logger.debug("Config backend_user: %s" % backend_user)
     logger.debug("Config backend_password: %s" % backend_password)
@@ -190,272 +440,65 @@ def main():
 
     logger.debug("Config servers: %s" % config_servers)
 
+    # validate the UUID for the imported project once for all target servers
+    if args.import_from_file:
+        if args.project_name:
+            logger.fatal("Import can only be used in combination with --project-id argument specifying "
+                         "a UUID for the new project on the target server.")
+            raise ProxyError()
+        else:
+            project_uuid = args.project_id.strip().lower()
+            if not UUID4_PATTERN.fullmatch(project_uuid):
+                logger.fatal("Provided project-id %s is not a valid UUID4 (like, e.g., "
+                             "f1d1e2b8-c41f-42cf-97d4-513f3fd01cd2)." % args.project_id)
+                raise ProxyError()
+            args.project_id = project_uuid
+
+    # compile regular expressions used to match target servers and project names only once
+    target_server_pattern = re.compile(args.target_server)
+    if args.project_name:
+        project_name_pattern = re.compile(args.project_name)
+    else:
+        project_name_pattern = None
+
     try:
         username = backend_user
         password = backend_password
 
         # Try to find match for target server in config
         if len(config_servers) > 0:
-            base_dst_api_url = None
-            duplicate_number = args.duplicate_start
+            matched_servers = list()
             for server in config_servers:
-                if re.fullmatch(args.target_server, server):
+                if target_server_pattern.fullmatch(server):
                     logger.debug("Target server found: %s (%s) using provided match: %s" % (server,
                                                                                             config_servers[server],
                                                                                             args.target_server))
-                    # build target server API URL
-                    base_dst_api_url = "http://" + config_servers[server] + ":" + str(backend_port) + "/v2"
-
-                    if args.import_from_file:
-                        if args.project_name:
-                            logger.fatal("Import can only be used in combination with --project-id argument specifying "
-                                         "a UUID for the new project on the target server.")
-                            raise ProxyError()
-                        else:
-                            try:
-                                project_uuid = str(uuid.UUID(args.project_id, version=4))
-                            except ValueError:
-                                logger.fatal("Provided project-id %s is not a valid UUID4 (like, e.g., "
-                                             "f1d1e2b8-c41f-42cf-97d4-513f3fd01cd2)." % args.project_id)
-                                raise ProxyError()
-
-                        logger.debug("Checking if target project exists...")
-                        url = base_dst_api_url + '/projects/' + project_uuid
-                        r = requests.get(url, auth=(username, password))
-                        if r.status_code == 200:
-                            logger.debug("Project UUID: %s already exists on server: %s."
-                                         % (project_uuid, config_servers[server]))
-
-                            if args.force:
-                                # close destination project
-                                logger.debug("Closing destination project")
-                                url = base_dst_api_url + '/projects/' + project_uuid + "/close"
-                                data = "{}"
-                                r = requests.post(url, data, auth=(username, password))
-                                if not r.status_code == 201 and not r.status_code == 204:
-                                    if r.status_code == 404:
-                                        logger.debug("Project did not exist before, not closed")
-                                    else:
-                                        raise ProxyError()
-
-                                # deleting project
-                                print("Deleting existing project UUID %s on server: %s"
-                                      % (project_uuid, config_servers[server]))
-                                r = requests.delete(base_dst_api_url + '/projects/' + project_uuid,
-                                                    auth=(username, password))
-                                if not r.status_code == 204:
-                                    if r.status_code == 404:
-                                        logger.debug("Project did not exist before, not deleted")
-                                    else:
-                                        logger.fatal("unable to delete project")
-                                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                        raise ProxyError()
-
-                            else:
-                                logger.fatal("    WARNING: Project UUID: %s already exists on server: %s import "
-                                             "failed, use --force to overwrite."
-                                             % (project_uuid, config_servers[server]))
-                                continue
-
-                        logger.debug("Importing project")
-                        # import project
-                        url = base_dst_api_url + '/projects/' + project_uuid + "/import"
-                        files = {'file': open(args.import_from_file, 'rb')}
-                        r = requests.post(url, files=files, auth=(username, password))
-                        if not r.status_code == 201:
-                            if r.status_code == 403:
-                                logger.fatal("Forbidden to import project on target server.")
-                                logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                raise ProxyError()
-                            else:
-                                logger.fatal("Unable to import project on target server.")
-                                logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                raise ProxyError()
-                        else:
-                            print("#### Project %s imported from file: %s on server: %s"
-                                  % (project_uuid, args.import_from_file, server))
-                    else:
-                        logger.debug("Searching target project UUIDs")
-                        projects = list()
-                        url = base_dst_api_url + '/projects'
-                        r = requests.get(url, auth=(username, password))
-                        if not r.status_code == 200:
-                            logger.fatal("Could not list projects.")
-                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                            raise ProxyError()
-                        else:
-                            project_results = json.loads(r.text)
-                            for project in project_results:
-                                if args.project_id:
-                                    if args.project_id == project['project_id']:
-                                        logger.debug('matched UUID of: %s' % project)
-                                        projects.append(project)
-                                else:
-                                    if re.fullmatch(args.project_name, project['name']):
-                                        logger.debug('matched name of: %s' % project)
-                                        projects.append(project)
-
-                            if len(projects) == 0:
-                                print("#### No matching projects found on server: %s"
-                                      % (server))
-
-                            for project in projects:
-                                project_uuid = project['project_id']
-                                if args.export_to_dir:
-                                    # Closing project
-                                    logger.debug("Closing project")
-                                    url = base_dst_api_url + '/projects/' + project_uuid + "/close"
-                                    data = "{}"
-                                    r = requests.post(url, data, auth=(username, password))
-                                    if not r.status_code == 201 and not r.status_code == 204:
-                                        logger.fatal("Unable to close project. Project does not exist or is corrupted?")
-                                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                        raise ProxyError()
-
-                                    # export project
-                                    logger.debug("Exporting project")
-                                    url = base_dst_api_url + '/projects/' + project_uuid + "/export?"
-                                    if args.include_base_images:
-                                        url = url + "include_images=yes"
-                                    else:
-                                        url = url + "include_images=no"
-                                    if args.include_snapshots:
-                                        url = url + "&include_snapshots=yes"
-                                    else:
-                                        url = url + "&include_snapshots=no"
-                                    if args.reset_mac_addresses:
-                                        url = url + "&reset_mac_addresses=yes"
-                                    else:
-                                        url = url + "&reset_mac_addresses=no"
-                                    url = url + "&compression=" + args.compression
-                                    r = requests.get(url, stream=True, auth=(username, password))
-                                    if r.status_code == 200:
-                                        r.raw.decode_content = True
-                                        filename = str(server) + "_" + project['name'] + "_" + project_uuid + "_" + \
-                                                   time.strftime("%Y%m%d-%H%M%S") + "." + args.compression
-                                        shutil.copyfileobj(r.raw, open(os.path.join(args.export_to_dir, filename), 'wb'))
-                                        print("#### Project %s (%s) exported to file: %s (%s bytes) from server: %s"
-                                              % (project['name'], project['project_id'], filename,
-                                                 os.stat(os.path.join(args.export_to_dir, filename)).st_size, server))
-                                    else:
-                                        logger.fatal("Unable to export project from source server.")
-                                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                        raise ProxyError()
-
-                                if args.delete:
-                                    if args.force:
-                                        # close destination project
-                                        logger.debug("Closing destination project")
-                                        url = base_dst_api_url + '/projects/' + project_uuid + "/close"
-                                        data = "{}"
-                                        r = requests.post(url, data, auth=(username, password))
-                                        if not r.status_code == 201 and not r.status_code == 204:
-                                            if r.status_code == 404:
-                                                logger.debug("Project did not exist before, not closed")
-                                            else:
-                                                raise ProxyError()
-
-                                        # deleting project
-                                        print("#### Deleting project UUID %s on server: %s"
-                                              % (project_uuid, config_servers[server]))
-                                        r = requests.delete(base_dst_api_url + '/projects/' + project_uuid,
-                                                            auth=(username, password))
-                                        if not r.status_code == 204:
-                                            if r.status_code == 404:
-                                                logger.debug("Project did not exist before, not deleted")
-                                            else:
-                                                logger.fatal("unable to delete project")
-                                                logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                                raise ProxyError()
-                                    else:
-                                        print("    WARNING: Project UUID %s to delete found on server: %s, use --force"
-                                              " to really remove it." % (project_uuid, config_servers[server]))
-
-                                if args.duplicate:
-                                    project_name = project["name"]
-                                    if args.duplicates_per_target_server > 0:
-                                        duplicates_created_on_server = 0
-                                    else:
-                                        duplicate_number = args.duplicate_start
-                                    while duplicate_number <= args.duplicate_end:
-                                        if args.duplicate_name is not None:
-                                            duplicate_project_name = args.duplicate_name + str(duplicate_number)
-                                        else:
-                                            duplicate_project_name = project_name + str(duplicate_number)
-                                        print("#### Duplicating project %s (%s) on server: %s, new name: %s"
-                                              % (project_name, project_uuid, config_servers[server],
-                                                 duplicate_project_name))
-                                        url = base_dst_api_url + '/projects/' + project_uuid + "/duplicate"
-                                        json_data = {'name': duplicate_project_name,
-                                                     'reset_mac_addresses': args.reset_mac_addresses}
-                                        data = json.dumps(json_data)
-                                        r = requests.post(url, data, auth=(username, password))
-                                        if not r.status_code == 201:
-                                            logger.fatal("Unable to duplicate project on target server.")
-                                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                            raise ProxyError()
-                                        duplicate_number = duplicate_number + 1
-                                        if args.duplicates_per_target_server > 0:
-                                            duplicates_created_on_server = duplicates_created_on_server + 1
-                                            if duplicates_created_on_server >= args.duplicates_per_target_server:
-                                                break
-
-                                if args.show:
-                                    print("#### Server: %s, Project Name: %s, Project_ID: %s, Status: %s, "
-                                          % (server, project['name'], project['project_id'], project['status']))
-
-                                if args.start:
-                                    print(
-                                        "#### Opening and starting project: %s on %s" % (project['project_id'], server))
-
-                                    # Opening project
-                                    logger.debug("Opening target project")
-                                    url = base_dst_api_url + '/projects/' + project['project_id'] + "/open"
-                                    data = "{}"
-                                    r = requests.post(url, data, auth=(username, password))
-                                    if not r.status_code == 201:
-                                        logger.fatal("Unable to open project on target server.")
-                                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                        raise ProxyError()
-
-                                    # Starting project
-                                    logger.debug("Starting destination project")
-                                    url = base_dst_api_url + '/projects/' + project['project_id'] + "/nodes/start"
-                                    data = "{}"
-                                    r = requests.post(url, data, auth=(username, password))
-                                    if not r.status_code == 204:
-                                        logger.fatal("Unable to start project on target server.")
-                                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                        raise ProxyError()
-
-                                if args.stop:
-                                    print(
-                                        "#### Stopping and closing project: %s on %s" % (project['project_id'], server))
-
-                                    # Stopping project
-                                    logger.debug("Stopping destination project")
-                                    url = base_dst_api_url + '/projects/' + project['project_id'] + "/nodes/stop"
-                                    data = "{}"
-                                    r = requests.post(url, data, auth=(username, password))
-                                    if not r.status_code == 204:
-                                        logger.fatal("Unable to stop project on target server.")
-                                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                        raise ProxyError()
-
-                                    # Closing project
-                                    logger.debug("Closing project")
-                                    url = base_dst_api_url + '/projects/' + project['project_id'] + "/close"
-                                    data = "{}"
-                                    r = requests.post(url, data, auth=(username, password))
-                                    if not r.status_code == 201 and not r.status_code == 204:
-                                        logger.fatal("Unable to close project. Project does not exist or is corrupted?")
-                                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                        raise ProxyError()
-
-            if base_dst_api_url is None:
+                    matched_servers.append(server)
+
+            if len(matched_servers) == 0:
                 logger.fatal("Could not find target server %s." % args.target_server)
                 raise ProxyError()
 
+            duplicate_numbers = itertools.count(args.duplicate_start)
+            if args.duplicate and args.duplicates_per_target_server > 0:
+                # duplicate numbers are distributed across the servers in order, handle them one after another
+                max_workers = 1
+            else:
+                max_workers = min(32, len(matched_servers))
+
+            # share a session to reuse connections to the backends
+            with requests.Session() as session:
+                session.auth = (username, password)
+                session.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=64))
+
+                # servers are independent of each other, run the action against them concurrently
+                with interruptible_executor(max_workers) as executor:
+                    futures = [executor.submit(process_server, server, config_servers[server], backend_port,
+                                               session, args, project_name_pattern, duplicate_numbers)
+                               for server in matched_servers]
+                    for future in futures:
+                        future.result()
+
         print("Done.")
 
     except KeyboardInterrupt:
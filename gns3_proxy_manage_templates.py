@@ -14,13 +14,17 @@ import configparser
 import json
 import logging
 import re
+import socket
 import sys
 import os
 import time
-from ipaddress import ip_address
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from packaging import version
 
 import requests
+from requests.adapters import HTTPAdapter
 
 VERSION = (0, 3)
 __version__ = '.'.join(map(str, VERSION[0:2]))
@@ -33,6 +37,12 @@ __license__ = 'BSD'
 
 logger = logging.getLogger(__name__)
 
+# serializes console output of servers handled concurrently
+print_lock = threading.Lock()
+
+# set on Ctrl-C to stop the workers still running, as they are not waited for
+stop_event = threading.Event()
+
 PY3 = sys.version_info[0] == 3
 
 if PY3:  # pragma: no cover
@@ -52,12 +62,65 @@ DEFAULT_DELETE_ACTION = False
 DEFAULT_SHOW_ACTION = False
 DEFAULT_FORCE = False
 DEFAULT_INCLUDE_BUILTIN = False
+DEFAULT_NO_VERSION_CACHE = False
+
+# Versions of the target servers are cached between runs, as they only change on upgrades
+VERSION_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'gns3_proxy', 'versions.json')
+VERSION_CACHE_MAX_AGE = 24 * 60 * 60
+
+# Characters that make a --target-server value a regular expression instead of a plain server name
+REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+# Sections of the settings of GNS3 <2.2 containing the configuration of each node type and the
+# settings of the node type that are not supported anymore in GNS3 >=2.2
+NODE_TYPE_SETTINGS = {
+    'cloud': ('Builtin', 'cloud_nodes', ()),
+    'ethernet_hub': ('Builtin', 'ethernet_hubs', ()),
+    'ethernet_switch': ('Builtin', 'ethernet_switches', ()),
+    'docker': ('Docker', 'containers', ()),
+    'dynamips': ('Dynamips', 'routers', ('chassis', 'iomem')),
+    'iou': ('IOU', 'devices', ()),
+    'qemu': ('Qemu', 'vms', ('acpi_shutdown',)),
+    'vmware': ('VMware', 'vms', ()),
+    'vpcs': ('VPCS', 'nodes', ()),
+    'virtualbox': ('VirtualBox', 'vms', ()),
+}
 
 
 class ProxyError(Exception):
     pass
 
 
+def synchronized_print(message):
+    """Print a message without interleaving it with output of other threads."""
+    with print_lock:
+        print(message)
+
+
+def check_stopped():
+    """Raise ProxyError if the run was interrupted, called by workers between API calls."""
+    if stop_event.is_set():
+        raise ProxyError()
+
+
+@contextmanager
+def interruptible_executor(max_workers):
+    """Provide a ThreadPoolExecutor that is shut down like in a with statement, unless Ctrl-C was pressed.
+
+    On Ctrl-C running workers are not waited for, stop_event is set instead to let them and the workers not
+    started yet stop at their next check_stopped()."""
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    interrupted = False
+    try:
+        yield executor
+    except KeyboardInterrupt:
+        stop_event.set()
+        interrupted = True
+        raise
+    finally:
+        executor.shutdown(wait=not interrupted)
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser(
         description='gns3_proxy_manage_images.py v%s Manage templates on GNS3 proxy backends.' % __version__,
@@ -82,6 +145,10 @@ def parse_args(args):
     parser.add_argument('--include-builtin', action='store_true', default=DEFAULT_INCLUDE_BUILTIN,
                         help='Include builtin templates.')
 
+    parser.add_argument('--no-version-cache', action='store_true', default=DEFAULT_NO_VERSION_CACHE,
+                        help='Always request the GNS3 version of the target servers instead of using versions '
+                             'cached during the last 24 hours.')
+
     action_group = parser.add_mutually_exclusive_group(required=True)
     action_group.add_argument('--export-to-dir', type=str,
                               help='Export template to directory.')
@@ -99,14 +166,323 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
+def is_ip_address(value):
+    """Return whether value is a textual IPv4 or IPv6 address."""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, value)
+            return True
+        except OSError:
+            pass
+    return False
+
+
+def matching_templates(template_results, template_name_pattern, include_builtin):
+    """Yield the templates whose name matches template_name_pattern.
+
+    Builtin templates are skipped unless include_builtin is set."""
+    for template in template_results:
+
+        # skip builtin templates like Cloud, NAT, VPCS, Ethernet switch, Ethernet hub,
+        # Frame Relay switch, ATM switch
+        if template['builtin'] and not include_builtin:
+            logger.debug("#### Skipping builtin template: %s", template['name'])
+            continue
+
+        if template_name_pattern.fullmatch(template['name']):
+            yield template
+
+
+def load_version_cache():
+    """Return the cached versions of the target servers, or an empty cache if none can be read.
+
+    Malformed entries, e.g., of an edited or truncated cache file, are left out and treated as a cache miss."""
+    try:
+        with open(VERSION_CACHE_FILE, encoding='utf-8') as cache_file:
+            version_cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return dict()
+    if not isinstance(version_cache, dict):
+        return dict()
+    return {url: entry for url, entry in version_cache.items()
+            if isinstance(entry, dict)
+            and isinstance(entry.get('timestamp'), (int, float))
+            and isinstance(entry.get('version'), str)}
+
+
+def save_version_cache(version_cache):
+    try:
+        os.makedirs(os.path.dirname(VERSION_CACHE_FILE), exist_ok=True)
+        with open(VERSION_CACHE_FILE, 'w', encoding='utf-8') as cache_file:
+            json.dump(version_cache, cache_file)
+    except OSError as e:
+        logger.debug("Could not write version cache %s: %s", VERSION_CACHE_FILE, e)
+
+
+def get_templates(server_address, session, base_dst_api_url, version_cache, use_cached_version):
+    """Return whether the target server uses the new template API of GNS3 >=2.2 and its templates."""
+    # check version of target server, template format changed from GNS3 2.1 to 2.2
+    r_templates = None
+    cached_version = version_cache.get(base_dst_api_url)
+    if use_cached_version and cached_version is not None \
+            and time.time() - cached_version['timestamp'] < VERSION_CACHE_MAX_AGE:
+        server_version = cached_version['version']
+        logger.debug("Using cached version %s of server %s", server_version, server_address)
+    else:
+        # templates of GNS3 >=2.2 are requested at the same time to save a round trip, as most servers
+        # run a current version, the response is only discarded for old servers
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            version_future = executor.submit(session.get, f"{base_dst_api_url}/version")
+            templates_future = executor.submit(session.get, f"{base_dst_api_url}/templates")
+            r = version_future.result()
+            r_templates = templates_future.result()
+
+        if r.status_code == 200:
+            server_version = r.json()['version']
+            version_cache[base_dst_api_url] = {'version': server_version, 'timestamp': time.time()}
+        else:
+            logger.fatal("Could not connect to target server. Could not determine its version.")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+
+    if version.parse(server_version) < version.parse("2.2.0"):
+        # logger.fatal("Target server must use GNS3 >= 2.2. Template format has changed. See GNS3 "
+        #              "2.2 installation documentation, for steps to migrate GNS3 server from 2.1 "
+        #              "to 2.2.")
+        # raise ProxyError()
+
+        synchronized_print("Target server is running GNS3 <2.2 (%s) using old appliance template API" %
+                           server_version)
+        new_template_api = False
+    else:
+        synchronized_print("Target server is running GNS3 >=2.2 (%s) using new template API" %
+                           server_version)
+        new_template_api = True
+
+    logger.debug("Getting templates...")
+    if not new_template_api:
+        r = session.get(f"{base_dst_api_url}/appliances")
+    elif r_templates is None:
+        r = session.get(f"{base_dst_api_url}/templates")
+    else:
+        r = r_templates
+    if r.status_code == 200:
+        return new_template_api, r.json()
+    else:
+        logger.fatal("Could not get status of templates from server %s.", server_address)
+        logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+        raise ProxyError()
+
+
+def delete_template(template, server_address, session, base_dst_api_url, new_template_api):
+    """Delete a single template on the target server."""
+    logger.debug("Deleting template %s on server: %s", template['name'], server_address)
+
+    if new_template_api:
+        r = session.delete(f"{base_dst_api_url}/templates/{template['template_id']}")
+    else:
+        r = session.delete(f"{base_dst_api_url}/appliances/{template['appliance_id']}")
+
+    if not r.status_code == 204:
+        if r.status_code == 404:
+            logger.debug("Template did not exist before, not deleted")
+        else:
+            logger.fatal("unable to delete template")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+    else:
+        synchronized_print("#### Deleted template %s on server: %s" % (template['name'], server_address))
+
+
+def show_templates(server, templates, new_template_api, args):
+    """Show the matching templates of the target server."""
+    synchronized_print("#### Showing template %s on server: %s" % (args.template_name, server))
+
+    for template in templates:
+        # old <2.2 GNS3 API uses node_type instead of template_type
+        template_type = template['template_type'] if new_template_api else template['node_type']
+        synchronized_print("#### Server: %s, Template name: %s, type: %s"
+                           % (server, template['name'], template_type))
+
+
+def delete_templates(server, server_address, templates, session, base_dst_api_url, new_template_api, args):
+    """Delete the matching templates on the target server."""
+    synchronized_print("#### Deleting template %s on server: %s" % (args.template_name, server))
+
+    if not new_template_api:
+        logger.fatal("Deletion of templates is not supported on target servers using GNS3"
+                     " <2.2 (old template API).")
+        raise ProxyError()
+
+    for template in templates:
+        check_stopped()
+        if args.force:
+            delete_template(template, server_address, session, base_dst_api_url, new_template_api)
+        else:
+            synchronized_print("     WARNING: Template %s to delete found on server: %s, use --force"
+                               " to really remove it." % (template['name'], server_address))
+
+
+def export_templates(server, server_address, templates, session, base_dst_api_url, new_template_api, args):
+    """Export the matching templates of the target server to files in args.export_to_dir."""
+    synchronized_print("#### Exporting template %s on server: %s" % (args.template_name, server))
+
+    if not new_template_api:
+        # settings are the same for all templates, get them only once
+        url = f"{base_dst_api_url}/settings"
+        r = session.get(url)
+        if r.status_code == 200:
+            settings_results = r.json()
+            # index the settings of each node type by name
+            # sections of node types not installed on the server may be missing
+            settings_by_name = {node_type: {node['name']: node
+                                            for node in settings_results.get(section, {}).get(key, [])}
+                                for node_type, (section, key, _) in NODE_TYPE_SETTINGS.items()}
+        else:
+            logger.fatal("Could not get settings to export templates to new format from server %s.",
+                         server_address)
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+
+    # use the same timestamp for all files of this export
+    export_timestamp = time.strftime("%Y%m%d-%H%M%S")
+
+    for template in templates:
+        logger.debug("Found template: %s on server %s", template['name'], server)
+
+        if new_template_api:
+            filename = f"{server}_{template['template_type']}_{template['name']}_{template['template_id']}_" \
+                       f"{export_timestamp}.gns3a"
+        else:
+            filename = f"MIGRATED_{server}_{template['node_type']}_{template['name']}_{template['appliance_id']}_" \
+                       f"{export_timestamp}.gns3a"
+
+            # old <2.2 GNS3 API did not include config of the template in appliance
+            # definition needs to be extracted from settings
+            if template['node_type'] not in settings_by_name:
+                logger.fatal(
+                    "Template type %s of template %s not supported. Cannot be converted.",
+                    template['node_type'], template['name'])
+                raise ProxyError()
+
+            node = settings_by_name[template['node_type']].get(template['name'])
+            if node is not None:
+                for unsupported_setting in NODE_TYPE_SETTINGS[template['node_type']][2]:
+                    node.pop(unsupported_setting, None)
+                template.update(node)
+
+            # old <2.2 GNS3 API used appliance_id and node_type, needs to be
+            # converted to be able to import template to 2.2
+
+            # 'appliance_id' is now 'template_id' in GNS3 2.2
+            # 'node_type' is now 'template_type' in GNS3 2.2
+            template['template_id'] = template.pop('appliance_id')
+            template['template_type'] = template.pop('node_type')
+
+            # platform could be null is old GNS3 2.1 templates, GNS3 2.2 only allows the
+            # following:
+            # None is not one of [\'aarch64\', \'alpha\', \'arm\', \'cris\', \'i386\',
+            # \'lm32\', \'m68k\', \'microblaze\', \'microblazeel\', \'mips\', \'mips64\',
+            # \'mips64el\', \'mipsel\', \'moxie\', \'or32\', \'ppc\', \'ppc64\', \'ppcemb\',
+            # \'s390x\', \'sh4\', \'sh4eb\', \'sparc\', \'sparc64\', \'tricore\',
+            # \'unicore32\', \'x86_64\', \'xtensa\', \'xtensaeb\', \'\']"
+            if 'platform' in template:
+                if template['platform'] is None:
+                    template.pop('platform')
+
+        # encode the template in one go and write it with a single call, json.dump() would issue a
+        # write for every token; keys stay sorted to keep exports of the same template comparable
+        with open(os.path.join(args.export_to_dir, filename), 'w',
+                  encoding="utf8") as outfile:
+            outfile.write(json.dumps(template, sort_keys=True, indent=4))
+
+        synchronized_print("#### Exported template %s from server: %s to file: %s"
+                           % (template['name'], server_address,
+                              os.path.join(args.export_to_dir, filename)))
+
+
+def import_template(server, server_address, templates, session, base_dst_api_url, new_template_api, args):
+    """Import the template from args.import_from_file to the target server."""
+    synchronized_print("#### Importing template %s on server: %s" % (args.template_name, server))
+
+    if not new_template_api:
+        logger.fatal("Import of templates is not supported on target servers using GNS3"
+                     " <2.2 (old template API).")
+        raise ProxyError()
+
+    logger.debug("Checking if target template exists...")
+    if len(templates) > 1:
+        logger.fatal(
+            "Multiple templates matched %s on server %s. Import can only be used for single template.",
+            args.template_name, server_address)
+        raise ProxyError()
+    if templates:
+        template = templates[0]
+        logger.debug("Template: %s already exists on server %s", template, server)
+        if args.force:
+            synchronized_print("#### Forcing deletion of template %s on server: %s" % (
+                               args.template_name, server))
+            delete_template(template, server_address, session, base_dst_api_url, new_template_api)
+        else:
+            logger.fatal(
+                "Template: %s already exists on server %s. Use --force to overwrite it during import.",
+                template['name'], server)
+            raise ProxyError()
+
+    logger.debug("Importing template")
+    # import template
+    url = f"{base_dst_api_url}/templates"
+    # the open file is passed on as is, requests takes the content length from the file size and
+    # sends the body in blocks, so the template file is never read into memory as a whole
+    with open(args.import_from_file, 'rb') as payload:
+        headers = {'content-type': 'application/json'}
+        r = session.post(url, data=payload, verify=False, headers=headers)
+    if not r.status_code == 201:
+        if r.status_code == 403:
+            logger.fatal("Forbidden to import template on target server.")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+        else:
+            logger.fatal(
+                "Unable to import template on target server. Response: %s ", r.content)
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+    else:
+        synchronized_print("#### Template %s imported from file: %s on server: %s"
+                           % (r.json()['name'], args.import_from_file, server))
+
+
+def process_server(server, server_address, backend_port, session, args, template_name_pattern, version_cache):
+    """Run the requested action against a single target server."""
+    check_stopped()
+    # build target server API URL
+    base_dst_api_url = f"http://{server_address}:{backend_port}/v2"
+
+    # get and filter templates once for all actions, an imported template must not clash with a
+    # builtin template either
+    new_template_api, template_results = get_templates(server_address, session, base_dst_api_url, version_cache,
+                                                       not args.no_version_cache)
+    include_builtin = args.include_builtin or args.import_from_file is not None
+    templates = list(matching_templates(template_results, template_name_pattern, include_builtin))
+
+    if args.show:
+        show_templates(server, templates, new_template_api, args)
+    elif args.delete:
+        delete_templates(server, server_address, templates, session, base_dst_api_url, new_template_api, args)
+    elif args.export_to_dir:
+        export_templates(server, server_address, templates, session, base_dst_api_url, new_template_api, args)
+    elif args.import_from_file:
+        import_template(server, server_address, templates, session, base_dst_api_url, new_template_api, args)
+
+
 def main():
     # parse arguments
     args = parse_args(sys.argv[1:])
 
     # parse config file gns3_proxy_config.ini
     config = configparser.ConfigParser()
-    config.read_file(open(args.config_file))
-    config.read(args.config_file)
+    with open(args.config_file, encoding='utf-8') as config_file:
+        config.read_file(config_file)
 
     logging.basicConfig(level=getattr(logging, args.log_level),
                         format='%(asctime)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s')
@@ -115,399 +491,91 @@ def main():
     #
     # description: Username to use to access backend GNS3 server
     # default: admin
-    if config.get('proxy', 'backend_user'):
-        backend_user = config.get('proxy', 'backend_user')
-    else:
-        backend_user = "admin"
+    backend_user = config.get('proxy', 'backend_user', fallback='') or "admin"
 
     # get backend_password
     #
     # description: Password to use to access backend GNS3 server
     # default: password
-    if config.get('proxy', 'backend_password'):
-        backend_password = config.get('proxy', 'backend_password')
-    else:
-        backend_password = "password"
+    backend_password = config.get('proxy', 'backend_password', fallback='') or "password"
 
     # get backend_port
     #
     # description: TCP port to use to access backend GNS3 server
     # default: 3080
-    if config.get('proxy', 'backend_port'):
-        backend_port = config.getint('proxy', 'backend_port')
-    else:
-        backend_port = 3080
+    backend_port = int(config.get('proxy', 'backend_port', fallback='') or 3080)
 
     # read servers from config
     if config.items('servers'):
         config_servers = dict()
         server_items = config.items('servers')
         for server, value in server_items:
-            try:
-                ip_address(value)
-            except ValueError:
-                logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)" % value)
+            if not is_ip_address(value):
+                logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)", value)
                 raise ProxyError()
             config_servers[server] = value
     else:
         config_servers = None
 
-    logger.debug("Config backend_user: %s" % backend_user)
-    logger.debug("Config backend_password: %s" % backend_password)
-    logger.debug("Config backend_port: %s" % backend_port)
+    logger.debug("Config backend_user: %s", backend_user)
+    logger.debug("Config backend_password: %s", backend_password)
+    logger.debug("Config backend_port: %s", backend_port)
+
+    logger.debug("Config servers: %s", config_servers)
 
-    logger.debug("Config servers: %s" % config_servers)
+    # compile regular expressions used to match target servers and template names only once
+    target_server_pattern = re.compile(args.target_server)
+    template_name_pattern = re.compile(args.template_name)
+
+    username = backend_user
+    password = backend_password
+
+    # share a session to reuse connections to the backends
+    session = requests.Session()
+    session.auth = (username, password)
+    session.mount('http://', HTTPAdapter(pool_connections=len(config_servers) or 1, pool_maxsize=16))
 
     try:
-        username = backend_user
-        password = backend_password
 
         # Try to find match for target server in config
         if len(config_servers) > 0:
-            base_dst_api_url = None
-            for server in config_servers:
-                if re.fullmatch(args.target_server, server):
-                    logger.debug("Target server found: %s (%s) using provided match: %s" % (server,
-                                                                                            config_servers[server],
-                                                                                            args.target_server))
-                    # build target server API URL
-                    base_dst_api_url = "http://" + config_servers[server] + ":" + str(backend_port) + "/v2"
-
-                    # check version of target server, template format changed from GNS3 2.1 to 2.2
-
-                    url = base_dst_api_url + '/version'
-                    r = requests.get(url, auth=(username, password))
-                    if r.status_code == 200:
-                        version_results = json.loads(r.text)
-                        server_version = version_results['version']
-                        if version.parse(server_version) < version.parse("2.2.0"):
-                            # logger.fatal("Target server must use GNS3 >= 2.2. Template format has changed. See GNS3 "
-                            #              "2.2 installation documentation, for steps to migrate GNS3 server from 2.1 "
-                            #              "to 2.2.")
-                            # raise ProxyError()
-
-                            print("Target server is running GNS3 <2.2 (%s) using old appliance template API" %
-                                  server_version)
-                            new_template_api = False
-                        else:
-                            print("Target server is running GNS3 >=2.2 (%s) using new template API" %
-                                  server_version)
-                            new_template_api = True
-                    else:
-                        logger.fatal("Could not connect to target server. Could not determine its version.")
-                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                        raise ProxyError()
-
-                    if args.show:
-                        print("#### Showing template %s on server: %s" % (args.template_name, server))
-
-                        logger.debug("Getting templates...")
-                        if new_template_api:
-                            url = base_dst_api_url + '/templates'
-                        else:
-                            url = base_dst_api_url + '/appliances'
-                        r = requests.get(url, auth=(username, password))
-                        if r.status_code == 200:
-                            template_results = json.loads(r.text)
-                            for template in template_results:
-
-                                # skip builtin templates like Cloud, NAT, VPCS, Ethernet switch, Ethernet hub,
-                                # Frame Relay switch, ATM switch
-                                if template['builtin'] and args.include_builtin is False:
-                                    logger.debug("#### Skipping builtin template: %s" % template['name'])
-                                    continue
-
-                                if re.fullmatch(args.template_name, template['name']):
-                                    print("#### Server: %s, Template name: %s, type: %s"
-                                          % (server, template['name'], template['template_type']))
-                        else:
-                            logger.fatal("Could not get status of templates from.")
-                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                            raise ProxyError()
-
-                    if args.delete:
-                        print("#### Deleting template %s on server: %s" % (args.template_name, server))
-
-                        logger.debug("Getting templates...")
-                        if new_template_api:
-                            url = base_dst_api_url + '/templates'
-                        else:
-                            logger.fatal("Deletion of templates is not supported on target servers using GNS3"
-                                         " <2.2 (old template API).")
-                            raise ProxyError()
-
-                        r = requests.get(url, auth=(username, password))
-                        if r.status_code == 200:
-                            template_results = json.loads(r.text)
-                            for template in template_results:
-
-                                # skip builtin templates like Cloud, NAT, VPCS, Ethernet switch, Ethernet hub,
-                                # Frame Relay switch, ATM switch
-                                if template['builtin'] and args.include_builtin is False:
-                                    logger.debug("#### Skipping builtin template: %s" % template['name'])
-                                    continue
-
-                                if re.fullmatch(args.template_name, template['name']):
-                                    if args.force:
-                                        logger.debug("Deleting template %s on server: %s"
-                                                     % (template['name'], config_servers[server]))
-
-                                        if new_template_api:
-                                            r = requests.delete(
-                                                base_dst_api_url + '/templates/' + template['template_id'],
-                                                auth=(username, password))
-                                        else:
-                                            r = requests.delete(
-                                                base_dst_api_url + '/appliances/' + template['appliance_id'],
-                                                auth=(username, password))
-
-                                        if not r.status_code == 204:
-                                            if r.status_code == 404:
-                                                logger.debug("Template did not exist before, not deleted")
-                                            else:
-                                                logger.fatal("unable to delete template")
-                                                logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                                raise ProxyError()
-                                        else:
-                                            print("#### Deleted template %s on server: %s"
-                                                  % (template['name'], config_servers[server]))
-                                    else:
-                                        print("     WARNING: Template %s to delete found on server: %s, use --force"
-                                              " to really remove it." % (template['name'], config_servers[server]))
-                        else:
-                            logger.fatal("Could not get status of templates from server %s." % config_servers[server])
-                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                            raise ProxyError()
-
-                    if args.export_to_dir:
-                        print("#### Exporting template %s on server: %s" % (args.template_name, server))
-
-                        logger.debug("Getting templates from target server...")
-                        if new_template_api:
-                            url = base_dst_api_url + '/templates'
-                        else:
-                            url = base_dst_api_url + '/appliances'
-                        r = requests.get(url, auth=(username, password))
-                        if r.status_code == 200:
-                            template_results = json.loads(r.text)
-                            for template in template_results:
-
-                                # skip builtin templates like Cloud, NAT, VPCS, Ethernet switch, Ethernet hub,
-                                # Frame Relay switch, ATM switch
-                                if template['builtin'] and args.include_builtin is False:
-                                    logger.debug("#### Skipping builtin template: %s" % template['name'])
-                                    continue
-
-                                if re.fullmatch(args.template_name, template['name']):
-                                    logger.debug("Found template: %s on server %s"
-                                                 % (template['name'], server))
-
-                                    if new_template_api:
-                                        filename = str(server) + "_" + template['template_type'] + "_" \
-                                                   + template['name'] + "_" + template['template_id'] + "_" \
-                                                   + time.strftime("%Y%m%d-%H%M%S") + ".gns3a"
-                                    else:
-                                        filename = "MIGRATED_" + str(server) + "_" + template['node_type'] + "_" \
-                                                   + template['name'] + "_" + template['appliance_id'] + "_" \
-                                                   + time.strftime("%Y%m%d-%H%M%S") + ".gns3a"
-
-                                        # old <2.2 GNS3 API did not include config of the template in appliance
-                                        # definition needs to be extracted from settings
-                                        url = base_dst_api_url + '/settings'
-                                        r = requests.get(url, auth=(username, password))
-                                        if r.status_code == 200:
-                                            settings_results = json.loads(r.text)
-                                            if template['node_type'] == "cloud":
-                                                for cloud_node in settings_results['Builtin']['cloud_nodes']:
-                                                    if cloud_node['name'] == template['name']:
-                                                        template.update(cloud_node)
-
-                                            elif template['node_type'] == "ethernet_hub":
-                                                for ethernet_hub_node in settings_results['Builtin']['ethernet_hubs']:
-                                                    if ethernet_hub_node['name'] == template['name']:
-                                                        template.update(ethernet_hub_node)
-
-                                            elif template['node_type'] == "ethernet_switch":
-                                                for ethernet_switch_node in \
-                                                        settings_results['Builtin']['ethernet_switches']:
-                                                    if ethernet_switch_node['name'] == template['name']:
-                                                        template.update(ethernet_switch_node)
-
-                                            elif template['node_type'] == "docker":
-                                                for container_node in settings_results['Docker']['containers']:
-                                                    if container_node['name'] == template['name']:
-                                                        template.update(container_node)
-
-                                            elif template['node_type'] == "dynamips":
-                                                for router_node in settings_results['Dynamips']['routers']:
-                                                    if router_node['name'] == template['name']:
-                                                        # 'chassis' and 'iomem' not supported in GNS3 >=2.2
-                                                        router_node.pop('chassis', None)
-                                                        router_node.pop('iomem', None)
-                                                        template.update(router_node)
-
-                                            elif template['node_type'] == "iou":
-                                                for iou_node in settings_results['IOU']['devices']:
-                                                    if iou_node['name'] == template['name']:
-                                                        template.update(iou_node)
-
-                                            elif template['node_type'] == "qemu":
-                                                for vm_node in settings_results['Qemu']['vms']:
-                                                    if vm_node['name'] == template['name']:
-                                                        # 'acpi_shutdown' not supported in GNS3 >=2.2
-                                                        vm_node.pop('acpi_shutdown', None)
-                                                        template.update(vm_node)
-
-                                            elif template['node_type'] == "vmware":
-                                                for vmware_node in settings_results['VMware']['vms']:
-                                                    if vmware_node['name'] == template['name']:
-                                                        template.update(vmware_node)
-
-                                            elif template['node_type'] == "vpcs":
-                                                for vpc_node in settings_results['VPCS']['nodes']:
-                                                    if vpc_node['name'] == template['name']:
-                                                        template.update(vpc_node)
-
-                                            elif template['node_type'] == "virtualbox":
-                                                for virtualbox_node in settings_results['VirtualBox']['vms']:
-                                                    if virtualbox_node['name'] == template['name']:
-                                                        template.update(virtualbox_node)
-
-                                            else:
-                                                logger.fatal(
-                                                    "Template type %s of template %s not supported. Cannot be "
-                                                    "converted."
-                                                    % (template['node_type'], template['name']))
-                                                raise ProxyError()
-
-                                        else:
-                                            logger.fatal(
-                                                "Could not get settings to export template to new format for %s."
-                                                % template['name'])
-                                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                            raise ProxyError()
-
-                                        # old <2.2 GNS3 API used appliance_id and node_type, needs to be
-                                        # converted to be able to import template to 2.2
-
-                                        # 'appliance_id' is now 'template_id' in GNS3 2.2
-                                        # 'node_type' is now 'template_type' in GNS3 2.2
-                                        template['template_id'] = template.pop('appliance_id')
-                                        template['template_type'] = template.pop('node_type')
-
-                                        # platform could be null is old GNS3 2.1 templates, GNS3 2.2 only allows the
-                                        # following:
-                                        # None is not one of [\'aarch64\', \'alpha\', \'arm\', \'cris\', \'i386\',
-                                        # \'lm32\', \'m68k\', \'microblaze\', \'microblazeel\', \'mips\', \'mips64\',
-                                        # \'mips64el\', \'mipsel\', \'moxie\', \'or32\', \'ppc\', \'ppc64\', \'ppcemb\',
-                                        # \'s390x\', \'sh4\', \'sh4eb\', \'sparc\', \'sparc64\', \'tricore\',
-                                        # \'unicore32\', \'x86_64\', \'xtensa\', \'xtensaeb\', \'\']"
-                                        if 'platform' in template:
-                                            if template['platform'] is None:
-                                                template.pop('platform')
-
-                                    with open(os.path.join(args.export_to_dir, filename), 'w',
-                                              encoding="utf8") as outfile:
-                                        json.dump(template, outfile, sort_keys=True, indent=4)
-
-                                    print("#### Exported template %s from server: %s to file: "
-                                          % (template['name'], config_servers[server]),
-                                          os.path.join(args.export_to_dir, filename))
-
-                        else:
-                            logger.fatal("Could not get status of templates from server %s." % config_servers[server])
-                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                            raise ProxyError()
-
-                    if args.import_from_file:
-                        print("#### Importing template %s on server: %s" % (args.template_name, server))
-
-                        logger.debug("Checking if target template exists...")
-                        if new_template_api:
-                            url = base_dst_api_url + '/templates'
-                        else:
-                            logger.fatal("Import of templates is not supported on target servers using GNS3"
-                                         " <2.2 (old template API).")
-                            raise ProxyError()
-                        r = requests.get(url, auth=(username, password))
-                        if r.status_code == 200:
-                            template_exists = False
-                            template_results = json.loads(r.text)
-                            template = None
-                            for template in template_results:
-                                if re.fullmatch(args.template_name, template['name']):
-                                    logger.debug("Template: %s already exists on server %s"
-                                                 % (template, server))
-                                    if template_exists:
-                                        logger.fatal(
-                                            "Multiple templates matched %s on server %s. "
-                                            "Import can only be used for single template." % (
-                                                args.template_name, config_servers[
-                                                    server]))
-                                        raise ProxyError()
-                                    else:
-                                        template_exists = True
-                            if template_exists:
-                                if args.force:
-                                    print("#### Forcing deletion of template %s on server: %s" % (
-                                        args.template_name, server))
-
-                                    logger.debug("Deleting template %s on server: %s"
-                                                 % (template['name'], config_servers[server]))
-                                    r = requests.delete(
-                                        base_dst_api_url + '/templates/' + template['template_id'],
-                                        auth=(username, password))
-                                    if not r.status_code == 204:
-                                        if r.status_code == 404:
-                                            logger.debug("Template did not exist before, not deleted")
-                                        else:
-                                            logger.fatal("unable to delete template")
-                                            raise ProxyError()
-                                    else:
-                                        print("#### Deleted template %s on server: %s"
-                                              % (template['name'], config_servers[server]))
-                                else:
-                                    logger.fatal(
-                                        "Template: %s already exists on server %s. Use --force to overwrite it"
-                                        " during import."
-                                        % (template['name'], server))
-                                    raise ProxyError()
-
-                            logger.debug("Importing template")
-                            # import template
-                            url = base_dst_api_url + '/templates'
-                            with open(args.import_from_file, 'rb') as payload:
-                                headers = {'content-type': 'application/json'}
-                                r = requests.post(url, auth=(username, password),
-                                                  data=payload, verify=False, headers=headers)
-                            if not r.status_code == 201:
-                                if r.status_code == 403:
-                                    logger.fatal("Forbidden to import template on target server.")
-                                    logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                    raise ProxyError()
-                                else:
-                                    logger.fatal(
-                                        "Unable to import template on target server. Response: %s " % r.content)
-                                    logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                    raise ProxyError()
-                            else:
-                                print("#### Template %s imported from file: %s on server: %s"
-                                      % (template['name'], args.import_from_file, server))
-
-                        else:
-                            logger.fatal("Could not get status of templates from server %s." % config_servers[server])
-                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                            raise ProxyError()
-
-            if base_dst_api_url is None:
-                logger.fatal("Could not find target server %s." % args.target_server)
+            matched_servers = list()
+            if REGEX_METACHARACTERS.isdisjoint(args.target_server):
+                # plain server name, can only match itself, look it up directly
+                if args.target_server in config_servers:
+                    matched_servers.append(args.target_server)
+            else:
+                for server in config_servers:
+                    if target_server_pattern.fullmatch(server):
+                        matched_servers.append(server)
+            for server in matched_servers:
+                logger.debug("Target server found: %s (%s) using provided match: %s", server,
+                             config_servers[server], args.target_server)
+
+            if len(matched_servers) == 0:
+                logger.fatal("Could not find target server %s.", args.target_server)
                 raise ProxyError()
 
+            version_cache = load_version_cache()
+
+            # servers are independent of each other, run the action against them concurrently
+            with interruptible_executor(min(32, len(matched_servers))) as executor:
+                futures = [executor.submit(process_server, server, config_servers[server], backend_port, session,
+                                           args, template_name_pattern, version_cache)
+                           for server in matched_servers]
+                for future in futures:
+                    future.result()
+
+            save_version_cache(version_cache)
+
         print("Done.")
 
     except KeyboardInterrupt:
         pass
 
+    finally:
+        session.close()
+
 
 if __name__ == '__main__':
     main()
@@ -11,15 +11,19 @@
 
 import argparse
 import configparser
-import json
+import hashlib
 import logging
 import re
+import socket
 import sys
 import time
-from ipaddress import ip_address
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from requests_toolbelt.streaming_iterator import StreamingIterator
 import requests
+from requests.adapters import HTTPAdapter
 
 VERSION = (0, 5)
 __version__ = '.'.join(map(str, VERSION[0:2]))
@@ -32,6 +36,12 @@ __license__ = 'BSD'
 
 logger = logging.getLogger(__name__)
 
+# serializes console output of targets handled concurrently
+print_lock = threading.Lock()
+
+# set on Ctrl-C to stop the workers still running, as they are not waited for
+stop_event = threading.Event()
+
 PY3 = sys.version_info[0] == 3
 
 if PY3:  # pragma: no cover
@@ -48,12 +58,49 @@ if PY3:  # pragma: no cover
 DEFAULT_CONFIG_FILE = 'gns3_proxy_config.ini'
 DEFAULT_LOG_LEVEL = 'INFO'
 DEFAULT_FORCE = False
+DEFAULT_BUFFER = 256 * 1024
+DEFAULT_PARALLEL = 4
+DEFAULT_PROGRESS_INTERVAL = 10
+DEFAULT_VERIFY = False
+
+# Minimum number of seconds between progress messages of a transfer
+PROGRESS_MIN_PERIOD = 1
 
 
 class ProxyError(Exception):
     pass
 
 
+def synchronized_print(message):
+    """Print a message without interleaving it with output of other threads."""
+    with print_lock:
+        print(message)
+
+
+def check_stopped():
+    """Raise ProxyError if the run was interrupted, called by workers before API calls and for transferred chunks."""
+    if stop_event.is_set():
+        raise ProxyError()
+
+
+@contextmanager
+def interruptible_executor(max_workers):
+    """Provide a ThreadPoolExecutor that is shut down like in a with statement, unless Ctrl-C was pressed.
+
+    On Ctrl-C running workers are not waited for, stop_event is set instead to let them and the workers not
+    started yet stop at their next check_stopped()."""
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    interrupted = False
+    try:
+        yield executor
+    except KeyboardInterrupt:
+        stop_event.set()
+        interrupted = True
+        raise
+    finally:
+        executor.shutdown(wait=not interrupted)
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser(
         description='gns3_proxy_replicate_images.py v%s Replicates images on GNS3 proxy backends.' % __version__,
@@ -79,12 +126,24 @@ def parse_args(args):
                         help='Name of the image to be replicated.'
                              'Can be specified as a regular expression to match multiple images.')
 
-    parser.add_argument('--buffer', type=int, required=False, default=8192,
-                        help='Number of bytes to use for buffering download and upload of images.')
+    parser.add_argument('--buffer', type=int, required=False, default=DEFAULT_BUFFER,
+                        help='Number of bytes to use for buffering download and upload of images. Each concurrent '
+                             'transfer to a target server uses its own buffer. Default: 262144.')
+
+    parser.add_argument('--parallel', type=int, required=False, default=DEFAULT_PARALLEL,
+                        help='Number of images to replicate at the same time. Default: 4.')
+
+    parser.add_argument('--progress-interval', type=int, required=False, default=DEFAULT_PROGRESS_INTERVAL,
+                        help='Print the progress of a transfer each time this percentage of the image has been '
+                             'transferred. Default: 10.')
 
     parser.add_argument('--source-server', type=str, required=True,
                         help='Source server to copy images from. A name of a server/backend defined in the '
                              'config file.')
+    parser.add_argument('--verify', action='store_true', default=DEFAULT_VERIFY,
+                        help='Verify the md5sum of the transferred data against the md5sum reported by the source '
+                             'server.')
+
     parser.add_argument('--target-server', type=str, required=True,
                         help='Target(s) to copy images to. Name of a servers/backends defined in the config file. '
                              'Can be specified as a regular expression to match multiple target servers.')
@@ -92,18 +151,174 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
+def is_ip_address(value):
+    """Return whether value is a textual IPv4 or IPv6 address."""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, value)
+            return True
+        except OSError:
+            pass
+    return False
+
+
+def get_target_md5sums(target_server, session):
+    """Return the md5sums of the images available on target_server indexed by their filename."""
+    url = target_server['images_url']
+    r = session.get(url)
+    if r.status_code == 200:
+        return {target_image['filename']: target_image['md5sum'] for target_image in r.json()}
+    else:
+        logger.fatal("Could not get status of images from server %s." % target_server['name'])
+        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
+        raise ProxyError()
+
+
+def replicate_image_to_target(image, target_server, target_md5sums, src_images_url, session, args):
+    """Replicate a single image from the source server to target_server.
+
+    target_md5sums contains the md5sums of the images already available on target_server. Returns the number
+    of bytes transferred or None if the image was already available on target_server."""
+    check_stopped()
+    image_filename = image['filename']
+    target_server_name = target_server['name']
+    target_server_address = target_server['address']
+    logger.debug("    Replicating image: %s to server: %s" % (image_filename, target_server_name))
+
+    logger.debug("Checking if target image exists...")
+    target_image_md5sum = target_md5sums.get(image_filename)
+    if target_image_md5sum is not None:
+        logger.debug("image: %s already exists on server %s" % (image_filename, target_server_name))
+        if args.force:
+            # deleting image
+            # print("Deleting existing image %s on server: %s"
+            #      % (image_to_delete, config_servers[server]))
+            # url = base_dst_api_url + image_backend_url + '/' + image_to_delete
+            # r = requests.delete(url, auth=(username, password))
+            # if not r.status_code == 204:
+            #    if r.status_code == 404:
+            #        logger.debug("Image did not exist before, not deleted")
+            #    else:
+            #        logger.fatal("unable to delete image")
+            #        raise ProxyError()
+            logger.debug(
+                "image: %s (%s) already exists on server %s. Overwriting it."
+                % (image_filename, image_filename, target_server_name))
+        elif image['md5sum'] == target_image_md5sum:
+            # unchanged image, decided on the listing alone without any further request
+            logger.debug(
+                "image: %s (%s) already exists on server %s, skipping transfer. "
+                "Use --force to overwrite it during import."
+                % (image_filename, image_filename, target_server_name))
+            return None
+        else:
+            logger.fatal(
+                "image: %s (%s) already exists on server, but the md5sum does not match."
+                "on target %s. Use --force to overwrite it during import."
+                % (image_filename, image_filename, target_server_name))
+            raise ProxyError()
+
+    # export source image
+    logger.debug("Opening source image")
+    url = f"{src_images_url}/{image_filename}"
+    r_export = session.get(url, stream=True)
+    if not r_export.status_code == 200:
+        logger.fatal("Unable to export image from source server.")
+        logger.debug("Status code: " + str(r_export.status_code) + " Text:" + r_export.text)
+        raise ProxyError()
+
+    start_timestamp = int(round(time.time()))
+
+    # hashlib releases the GIL while hashing, so verification does not hold back concurrent transfers
+    md5 = hashlib.md5() if args.verify else None
+
+    def generate_chunk():
+        # progress is printed each time another --progress-interval percent of the image is transferred,
+        # the byte count for that is computed once, so only chunks that print progress need to take the time
+        progress_interval_length = max(1, total_length * args.progress_interval // 100)
+        transferred_length_upload = 0
+        prev_transferred_length_upload = 0
+        next_length_to_print_upload = 0
+        prev_timestamp_upload = time.monotonic()
+        for in_chunk in r_export.iter_content(chunk_size=args.buffer):
+            # stop the transfer on Ctrl-C
+            check_stopped()
+            if in_chunk:
+                yield in_chunk
+                if md5 is not None:
+                    md5.update(in_chunk)
+                transferred_length_upload += len(in_chunk)
+                if transferred_length_upload >= next_length_to_print_upload:
+                    next_length_to_print_upload = \
+                        (transferred_length_upload // progress_interval_length + 1) * progress_interval_length
+                    curr_timestamp_upload = time.monotonic()
+                    duration_upload = curr_timestamp_upload - prev_timestamp_upload
+                    # fast transfers would flood the output when replicating to many servers, apart from
+                    # the first and last message, print at most one message per PROGRESS_MIN_PERIOD
+                    if prev_transferred_length_upload and transferred_length_upload < total_length \
+                            and duration_upload < PROGRESS_MIN_PERIOD:
+                        continue
+                    delta_length_upload = transferred_length_upload - prev_transferred_length_upload
+                    if duration_upload > 0:
+                        rate_upload = delta_length_upload / duration_upload
+                    else:
+                        rate_upload = 0
+                    prev_timestamp_upload = curr_timestamp_upload
+                    prev_transferred_length_upload = transferred_length_upload
+                    if total_length > 0:
+                        transferred_percentage_upload = transferred_length_upload * 100 // total_length
+                    else:
+                        transferred_percentage_upload = 0
+                    synchronized_print("Replicating to %s (%s) ... %d%% (%.3f MB/s)" %
+                                       (target_server_name, target_server_address,
+                                        transferred_percentage_upload, (rate_upload / 1000000)))
+
+    # import target image
+    logger.debug("Opening target image")
+    url = f"{target_server['upload_url']}/{image_filename}"
+    total_length = int(r_export.headers.get('content-length'))
+    # r_import = requests.post(url, auth=(username, password), data=generate_chunk())
+    streamer = StreamingIterator(total_length, generate_chunk())
+    r_import = session.post(url, data=streamer)
+    if not r_import.status_code == 200:
+        if r_import.status_code == 403:
+            logger.fatal("Forbidden to import image on target server.")
+            logger.debug("Status code: " + str(r_import.status_code) + " Text:" + r_import.text)
+            raise ProxyError()
+        else:
+            logger.fatal("Unable to import image on target server.")
+            logger.debug("Status code: " + str(r_import.status_code) + " Text:" + r_import.text)
+            raise ProxyError()
+    else:
+        if md5 is not None and md5.hexdigest() != image['md5sum']:
+            logger.fatal("md5sum %s of image %s replicated to server %s does not match md5sum %s of the source "
+                         "image." % (md5.hexdigest(), image_filename, target_server_name, image['md5sum']))
+            raise ProxyError()
+
+        end_timestamp = int(round(time.time()))
+
+        synchronized_print("#### image %s (%s bytes) replicated from server: %s to server: %s (in %i secs)"
+                           % (image_filename, total_length, args.source_server, target_server_name,
+                              (end_timestamp - start_timestamp)))
+        return total_length
+
+
 def main():
     # parse arguments
     args = parse_args(sys.argv[1:])
 
     # parse config file gns3_proxy_config.ini
     config = configparser.ConfigParser()
-    config.read_file(open(args.config_file))
-    config.read(args.config_file)
+    with open(args.config_file, encoding='utf-8') as config_file:
+        config.read_file(config_file)
 
     logging.basicConfig(level=getattr(logging, args.log_level),
                         format='%(asctime)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s')
 
+    if args.parallel < 1:
+        logger.fatal("--parallel must be at least 1.")
+        raise ProxyError()
+
     # get backend_user
     #
     # description: Username to use to access backend GNS3 server
@@ -132,33 +347,40 @@ def main():
         backend_port = 3080
 
     # Compute Image Backend
-    image_backend_url = '/compute/' + args.image_type + '/images'
+    image_backend_url = f"/compute/{args.image_type}/images"
 
     # Alternate location for image access, used for upload by the GNS3 client, but download (GET) throws an error
-    alt_image_backend_url = '/computes/local/' + args.image_type + '/images'
+    alt_image_backend_url = f"/computes/local/{args.image_type}/images"
 
     # read servers from config
-    if config.items('servers'):
-        config_servers = dict()
-        server_items = config.items('servers')
-        for server, value in server_items:
-            try:
-                ip_address(value)
-            except ValueError:
-                logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)" % value)
-                raise ProxyError()
-            config_servers[server] = value
-    else:
-        config_servers = None
+    server_items = config.items('servers')
+    for server, value in server_items:
+        if not is_ip_address(value):
+            logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)" % value)
+            raise ProxyError()
+    config_servers = dict(server_items)
 
     logger.debug("Config backend_user: %s" % backend_user)
     logger.debug("Config backend_password: %s" % backend_password)
     logger.debug("Config backend_port: %s" % backend_port)
 
     logger.debug("Config servers: %s" % config_servers)
+
+    # compile regular expressions used to match images and target servers only once
+    image_filename_pattern = re.compile(args.image_filename)
+    target_server_pattern = re.compile(args.target_server)
+
+    username = backend_user
+    password = backend_password
+
+    # share a session to keep connections to the servers alive across images and targets, each
+    # concurrent replication to a target streams from the source server using its own connection
+    session = requests.Session()
+    session.auth = (username, password)
+    session.mount('http://', HTTPAdapter(pool_connections=len(config_servers) or 1,
+                                         pool_maxsize=(len(config_servers) or 1) * args.parallel))
+
     try:
-        username = backend_user
-        password = backend_password
 
         # get source server IP
         if args.source_server in config_servers:
@@ -169,20 +391,21 @@ def main():
             logger.fatal("Source server not found in config.")
             raise ProxyError()
 
-        base_src_api_url = "http://" + src_server + ":" + str(backend_port) + "/v2"
+        base_src_api_url = f"http://{src_server}:{backend_port}/v2"
         logger.debug("Searching source images")
         images = list()
-        url = base_src_api_url + image_backend_url
+        src_images_url = f"{base_src_api_url}{image_backend_url}"
+        url = src_images_url
 
-        r = requests.get(url, auth=(username, password))
+        r = session.get(url)
         if not r.status_code == 200:
             logger.fatal("Could not list images.")
             logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
             raise ProxyError()
         else:
-            image_results = json.loads(r.text)
+            image_results = r.json()
             for image in image_results:
-                if re.fullmatch(args.image_filename, image['filename']):
+                if image_filename_pattern.fullmatch(image['filename']):
                     logger.debug('matched image: %s' % image['filename'])
                     images.append(image)
 
@@ -190,166 +413,73 @@ def main():
             logger.fatal("Specified image not found.")
             raise ProxyError()
 
-        for image in images:
-            image_filename = image['filename']
-            print("#### Replicating image: %s from server: %s (%s)" % (image_filename, args.source_server, src_server))
-
-            # target handling
-
-            # Try to find match for target server in config
-            target_servers = list()
-            if len(config_servers) > 0:
-                for key in config_servers:
-                    if re.fullmatch(args.target_server, key):
-                        logger.debug("Target server found: %s (%s) using provided match: %s" % (key,
-                                                                                                config_servers[key],
-                                                                                                args.target_server))
-                        if key == args.source_server:
-                            logger.debug("Target server %s is the same as the source server %s . Filtered out."
-                                         % (key, args.source_server))
-                        else:
-                            target_servers.append({'name': key, 'address': config_servers[key]})
-            else:
-                logger.fatal("No servers defined in config. Could not select target server.")
-                raise ProxyError()
-
-            if len(target_servers) == 0:
-                logger.fatal("No target servers found using match: %s. Could not select target server."
-                             % args.target_server)
-                raise ProxyError()
-
-            for target_server in target_servers:
-                target_server_name = target_server['name']
-                target_server_address = target_server['address']
-                logger.debug("    Replicating image: %s to server: %s" % (image_filename, target_server_name))
-                base_dst_api_url = "http://" + target_server_address + ":" + str(backend_port) + "/v2"
-
-                logger.debug("Checking if target image exists...")
-                url = base_dst_api_url + image_backend_url
-                r = requests.get(url, auth=(username, password))
-                if r.status_code == 200:
-                    target_image_exists = False
-                    target_image_md5sum = ''
-                    target_image_to_delete = ''
-                    target_image_results = json.loads(r.text)
-                    for target_image in target_image_results:
-                        if re.fullmatch(image_filename, target_image['filename']):
-                            logger.debug("image: %s already exists on server %s"
-                                         % (target_image['filename'], target_server_name))
-                            if target_image_exists:
-                                logger.fatal(
-                                    "Multiple images matched %s on server %s. "
-                                    "Import can only be used for single image." % (
-                                        image_filename, target_server_name))
-                                raise ProxyError()
-                            else:
-                                target_image_exists = True
-                                target_image_md5sum = target_image['md5sum']
-                                target_image_to_delete = image['filename']
-
-                    if target_image_exists:
-                        if args.force:
-                            # deleting image
-                            # print("Deleting existing image %s on server: %s"
-                            #      % (image_to_delete, config_servers[server]))
-                            # url = base_dst_api_url + image_backend_url + '/' + image_to_delete
-                            # r = requests.delete(url, auth=(username, password))
-                            # if not r.status_code == 204:
-                            #    if r.status_code == 404:
-                            #        logger.debug("Image did not exist before, not deleted")
-                            #    else:
-                            #        logger.fatal("unable to delete image")
-                            #        raise ProxyError()
-                            logger.debug(
-                                "image: %s (%s) already exists on server %s. Overwriting it."
-                                % (image_filename, target_image_to_delete, target_server_name))
-                        elif image['md5sum'] == target_image_md5sum:
-                            logger.debug(
-                                "image: %s (%s) already exists on server %s, skipping transfer. "
-                                "Use --force to overwrite it during import."
-                                % (image_filename, target_image_to_delete, target_server_name))
-                            continue
-                        else:
-                            logger.fatal(
-                                "image: %s (%s) already exists on server, but the md5sum does not match."
-                                "on target %s. Use --force to overwrite it during import."
-                                % (image_filename, target_image_to_delete, target_server_name))
-                            raise ProxyError()
-
-                    # export source image
-                    logger.debug("Opening source image")
-                    url = base_src_api_url + image_backend_url + '/' + image_filename
-                    r_export = requests.get(url, stream=True, auth=(username, password))
-                    if not r_export.status_code == 200:
-                        logger.fatal("Unable to export image from source server.")
-                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                        raise ProxyError()
-
-                    start_timestamp = int(round(time.time()))
-
-                    def generate_chunk():
-                        transferred_length_upload = 0
-                        prev_transferred_length_upload = 0
-                        next_percentage_to_print_upload = 0
-                        prev_timestamp_upload = int(round(time.time() * 1000))
-                        for in_chunk in r_export.iter_content(chunk_size=args.buffer):
-                            if in_chunk:
-                                yield in_chunk
-                                transferred_length_upload += len(in_chunk)
-                                if total_length > 0:
-                                    transferred_percentage_upload = int(
-                                        (transferred_length_upload / total_length) * 100)
-                                else:
-                                    transferred_percentage_upload = 0
-                                if transferred_percentage_upload >= next_percentage_to_print_upload:
-                                    curr_timestamp_upload = int(round(time.time() * 1000))
-                                    duration_upload = curr_timestamp_upload - prev_timestamp_upload
-                                    delta_length_upload = \
-                                        transferred_length_upload - prev_transferred_length_upload
-                                    if duration_upload > 0:
-                                        rate_upload = delta_length_upload / (duration_upload / 1000)
-                                    else:
-                                        rate_upload = 0
-                                    prev_timestamp_upload = curr_timestamp_upload
-                                    prev_transferred_length_upload = transferred_length_upload
-                                    print("Replicating to %s (%s) ... %d%% (%.3f MB/s)" %
-                                          (target_server_name, target_server_address, transferred_percentage_upload,
-                                           (rate_upload / 1000000)))
-                                    next_percentage_to_print_upload = next_percentage_to_print_upload + 5
-
-                    # import target image
-                    logger.debug("Opening target image")
-                    url = base_dst_api_url + alt_image_backend_url + '/' + image_filename
-                    total_length = int(r_export.headers.get('content-length'))
-                    # r_import = requests.post(url, auth=(username, password), data=generate_chunk())
-                    streamer = StreamingIterator(total_length, generate_chunk())
-                    r_import = requests.post(url, auth=(username, password), data=streamer)
-                    if not r_import.status_code == 200:
-                        if r_import.status_code == 403:
-                            logger.fatal("Forbidden to import image on target server.")
-                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                            raise ProxyError()
-                        else:
-                            logger.fatal("Unable to import image on target server.")
-                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                            raise ProxyError()
+        # target handling
+
+        # Try to find match for target server in config
+        target_servers = list()
+        if len(config_servers) > 0:
+            for key in config_servers:
+                if target_server_pattern.fullmatch(key):
+                    logger.debug("Target server found: %s (%s) using provided match: %s" % (key,
+                                                                                            config_servers[key],
+                                                                                            args.target_server))
+                    if key == args.source_server:
+                        logger.debug("Target server %s is the same as the source server %s . Filtered out."
+                                     % (key, args.source_server))
                     else:
-                        end_timestamp = int(round(time.time()))
-
-                        print("#### image %s (%s bytes) replicated from server: %s to server: %s (in %i secs)"
-                              % (image_filename, total_length, args.source_server, target_server_name,
-                                 (end_timestamp - start_timestamp)))
+                        # build the URLs of each target only once, not for every image
+                        base_dst_api_url = f"http://{config_servers[key]}:{backend_port}/v2"
+                        target_servers.append({'name': key, 'address': config_servers[key],
+                                               'images_url': f"{base_dst_api_url}{image_backend_url}",
+                                               'upload_url': f"{base_dst_api_url}{alt_image_backend_url}"})
+        else:
+            logger.fatal("No servers defined in config. Could not select target server.")
+            raise ProxyError()
 
-                else:
-                    logger.fatal("Could not get status of images from server %s." % target_server_name)
-                    logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                    raise ProxyError()
+        if len(target_servers) == 0:
+            logger.fatal("No target servers found using match: %s. Could not select target server."
+                         % args.target_server)
+            raise ProxyError()
 
+        # targets are independent of each other, handle them concurrently
+        with interruptible_executor(len(target_servers) * args.parallel) as executor:
+            # images on the targets are listed only once, not for every image to replicate
+            futures = [executor.submit(get_target_md5sums, target_server, session)
+                       for target_server in target_servers]
+            target_md5sums = [future.result() for future in futures]
+
+            def replicate_image(image):
+                check_stopped()
+                synchronized_print("#### Replicating image: %s from server: %s (%s)"
+                                   % (image['filename'], args.source_server, src_server))
+
+                image_futures = [executor.submit(replicate_image_to_target, image, target_server,
+                                                 target_server_md5sums, src_images_url, session, args)
+                                 for target_server, target_server_md5sums in zip(target_servers, target_md5sums)]
+                return [image_future.result() for image_future in image_futures]
+
+            start_timestamp = int(round(time.time()))
+
+            # images are independent of each other as well, replicate up to --parallel images at the same time
+            with interruptible_executor(args.parallel) as image_executor:
+                futures = [image_executor.submit(replicate_image, image) for image in images]
+                transferred_lengths = [length for future in futures for length in future.result()]
+
+            end_timestamp = int(round(time.time()))
+
+        replicated_lengths = [length for length in transferred_lengths if length is not None]
+        print("#### %i image(s) replicated to %i target server(s): %i transfer(s) with %i bytes, %i already up to "
+              "date (in %i secs)" % (len(images), len(target_servers), len(replicated_lengths),
+                                     sum(replicated_lengths), len(transferred_lengths) - len(replicated_lengths),
+                                     (end_timestamp - start_timestamp)))
         print("Done.")
 
     except KeyboardInterrupt:
         pass
 
+    finally:
+        session.close()
+
 
 if __name__ == '__main__':
     main()
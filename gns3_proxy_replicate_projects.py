@@ -13,16 +13,22 @@
 
 import argparse
 import configparser
-import json
+import itertools
 import logging
+import os
 import re
-import shutil
+import socket
 import sys
-from ipaddress import ip_address
-import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import datetime
 import tempfile
+from xml.sax.saxutils import escape
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+from urllib3.util.retry import Retry
 
 VERSION = (0, 5)
 __version__ = '.'.join(map(str, VERSION[0:2]))
@@ -35,6 +41,12 @@ __license__ = 'BSD'
 
 logger = logging.getLogger(__name__)
 
+# serializes console output of target servers handled concurrently
+print_lock = threading.Lock()
+
+# set on Ctrl-C to stop the workers still running, as they are not waited for
+stop_event = threading.Event()
+
 PY3 = sys.version_info[0] == 3
 
 if PY3:  # pragma: no cover
@@ -58,11 +70,50 @@ DEFAULT_INCLUDE_BASE_IMAGES = False
 DEFAULT_INCLUDE_SNAPSHOTS = False
 DEFAULT_RESET_MAC_ADDRESSES = False
 
+# Number of target servers a project is replicated to concurrently
+REPLICATION_WORKERS = 8
+
+# Number of node mac address changes sent concurrently to a single target server
+MAC_ADDRESS_WORKERS = 8
+
+# Buffer size used to write exported projects to disk
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
 
 class ProxyError(Exception):
     pass
 
 
+def synchronized_print(message):
+    """Print a message without interleaving it with output of other threads."""
+    with print_lock:
+        print(message)
+
+
+def check_stopped():
+    """Raise ProxyError if the run was interrupted, called by workers between API calls and transferred chunks."""
+    if stop_event.is_set():
+        raise ProxyError()
+
+
+@contextmanager
+def interruptible_executor(max_workers):
+    """Provide a ThreadPoolExecutor that is shut down like in a with statement, unless Ctrl-C was pressed.
+
+    On Ctrl-C running workers are not waited for, stop_event is set instead to let them and the workers not
+    started yet stop at their next check_stopped()."""
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    interrupted = False
+    try:
+        yield executor
+    except KeyboardInterrupt:
+        stop_event.set()
+        interrupted = True
+        raise
+    finally:
+        executor.shutdown(wait=not interrupted)
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser(
         description='gns3_proxy_replicate_projects.py v%s Replicate project to GNS3 proxy backends.' % __version__,
@@ -131,398 +182,429 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
+def is_ip_address(value):
+    """Return whether value is a textual IPv4 or IPv6 address."""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, value)
+            return True
+        except OSError:
+            pass
+    return False
+
+
+def export_project(project_uuid, export_file, base_src_api_url, session, args):
+    """Close the project on the source server and export it to export_file."""
+    check_stopped()
+    project_url = f"{base_src_api_url}/projects/{project_uuid}"
+
+    # close source project
+    logger.debug("Closing source project")
+    url = f"{project_url}/close"
+    r = session.post(url, json={})
+    if not r.status_code == 201 and not r.status_code == 204:
+        logger.fatal("Unable to close source project. Source project does not exist or is corrupted?")
+        logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+        raise ProxyError()
+
+    # export source project
+    logger.debug("Exporting source project")
+    url = f"{project_url}/export"
+    params = {'include_images': 'yes' if args.include_base_images else 'no',
+              'include_snapshots': 'yes' if args.include_snapshots else 'no',
+              'reset_mac_addresses': 'yes' if args.reset_mac_addresses else 'no',
+              'compression': args.compression}
+    # release the connection of the streamed response also if the export fails
+    with session.get(url, params=params, stream=True) as r:
+        if r.status_code == 200:
+            r.raw.decode_content = True
+            # copy the export chunk by chunk instead of using shutil.copyfileobj to be able to stop it on Ctrl-C
+            for chunk in iter(lambda: r.raw.read(EXPORT_BUFFER_SIZE), b''):
+                check_stopped()
+                export_file.write(chunk)
+            logger.debug("Project exported to file: %s (%s bytes)", export_file.name, export_file.tell())
+            export_file.close()
+        else:
+            logger.fatal("Unable to export project from source server.")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+
+
+def replicate_project_to_target(project, target_server_address, export_filename, export_future, session, args,
+                                backend_port, replication_timestamp, duplicate_numbers, mac_address_pattern):
+    """Import the exported project on a target server and apply the requested changes to it.
+
+    The existence of the target project is checked while the export is still running, export_future is waited for
+    before the target project is closed or deleted."""
+    check_stopped()
+    project_uuid = project['project_id']
+    project_name = project['name']
+
+    synchronized_print("    #### Replicating project: %s (%s) to server: %s " % (
+        project_name, project_uuid, target_server_address))
+    project_url = f"http://{target_server_address}:{backend_port}/v2/projects/{project_uuid}"
+
+    logger.debug("Checking if target project exists...")
+    r = session.get(project_url)
+    if r.status_code == 200:
+        if args.force:
+            synchronized_print("         Project UUID: %s already exists on server: %s overwriting it."
+                               % (project_uuid, target_server_address))
+        else:
+            synchronized_print("         WARNING: Project UUID: %s already exists on server: %s. Use --force"
+                               " to overwrite." % (project_uuid, target_server_address))
+            return
+
+    # wait for the export of the source project to finish, the target project must not be closed or deleted
+    # before the export succeeded, otherwise a failed export would leave the target without the project
+    export_future.result()
+    check_stopped()
+
+    # close destination project
+    logger.debug("Closing destination project")
+    url = f"{project_url}/close"
+    r = session.post(url, json={})
+    if not r.status_code == 201 and not r.status_code == 204:
+        if r.status_code == 404:
+            logger.debug("Destination project did not exist before, not closed")
+        else:
+            raise ProxyError()
+
+    if args.delete_target_project:
+        if args.force:
+            logger.debug("Deleting destination project")
+            r = session.delete(project_url)
+            if not r.status_code == 204:
+                if r.status_code == 404:
+                    logger.debug("Destination project did not exist before, not deleted")
+                else:
+                    logger.fatal("unable to delete project")
+                    logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+                    raise ProxyError()
+        else:
+            synchronized_print(
+                "        WARNING: Project UUID %s to delete found on server: %s, use --force to"
+                " really remove it." % (project_uuid, target_server_address))
+            return
+
+    logger.debug("Importing destination project")
+    # import project
+    url = f"{project_url}/import"
+    # every target reads the exported project using its own file handle, the multipart body is streamed from disk
+    # instead of building it in memory
+    with open(export_filename, 'rb') as export_file:
+        encoder = MultipartEncoder(fields={'file': (os.path.basename(export_filename), export_file,
+                                                    'application/octet-stream')})
+        # the monitor is called for each chunk read from the file, stop the upload on Ctrl-C
+        monitor = MultipartEncoderMonitor(encoder, lambda monitor: check_stopped())
+        r = session.post(url, data=monitor, headers={'Content-Type': monitor.content_type})
+    if not r.status_code == 201:
+        if r.status_code == 403:
+            logger.fatal("Forbidden to import project on target server.")
+            raise ProxyError()
+        elif r.status_code == 409:
+            logger.fatal("Project already partially created. Previous import seems to be interrupted. "
+                         "Try to restart GNS3 target server backend or use log level debug and check"
+                         "error status code and reason.")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+        else:
+            logger.fatal("Unable to import project on target server.")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+
+    if args.regenerate_mac_address or args.inject_replication_note:
+        # open target project
+        logger.debug("Open imported project to make changes.")
+        url = f"{project_url}/open"
+        r = session.post(url, json={})
+        if not r.status_code == 201:
+            logger.fatal("Unable to open imported project on target server.")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+
+    # check if we need to change MAC addresses in the target project
+    if args.regenerate_mac_address:
+        logger.debug("Trying to regenerate specified MAC addresses in target project.")
+
+        # getting target project nodes and search for mac address changes
+        logger.debug("Getting destination project nodes")
+        url = f"{project_url}/nodes"
+        r = session.get(url)
+        if not r.status_code == 200:
+            logger.fatal("Unable to get nodes from imported project on target server.")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+        else:
+            nodes = r.json()
+            mac_address_changes = list()
+            for node in nodes:
+                if 'properties' in node:
+                    properties = dict()
+                    if 'mac_address' in node['properties']:
+                        if mac_address_pattern.fullmatch(node['properties']['mac_address']):
+                            logger.debug('Found MAC address that needs to be changed: %s using match: %s',
+                                         node['properties']['mac_address'], args.regenerate_mac_address)
+                            mac_address = "02:01:00:%02x:%02x:%02x" % tuple(os.urandom(3))
+                            synchronized_print("         Changing mac address of node: %s from: %s to: %s"
+                                               % (node['name'], node['properties']['mac_address'], mac_address))
+                            properties['mac_address'] = mac_address
+                    if 'mac_addr' in node['properties']:
+                        if mac_address_pattern.fullmatch(node['properties']['mac_addr']):
+                            logger.debug('Found MAC address that needs to be changed: %s using match: %s',
+                                         node['properties']['mac_addr'], args.regenerate_mac_address)
+                            mac_addr = "0201.00%02x.%02x%02x" % tuple(os.urandom(3))
+                            synchronized_print("         Changing mac address of node: %s from: %s to: %s"
+                                               % (node['name'], node['properties']['mac_addr'], mac_addr))
+                            properties['mac_addr'] = mac_addr
+                    if properties:
+                        mac_address_changes.append((node, properties))
+
+            # changing mac addresses in target project nodes, nodes are independent of each other, change them
+            # concurrently
+            nodes_url = f"{project_url}/nodes/"
+            with ThreadPoolExecutor(max_workers=MAC_ADDRESS_WORKERS) as executor:
+                responses = list(executor.map(
+                    lambda change: session.put(nodes_url + change[0]['node_id'], json={'properties': change[1]}),
+                    mac_address_changes))
+            for (node, properties), r in zip(mac_address_changes, responses):
+                if not r.status_code == 200:
+                    logger.fatal("Unable to change mac address for node: %s in target project.", node['name'])
+                    logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+                    raise ProxyError()
+
+    # check if we need to inject a note describing the replication details in the project
+    if args.inject_replication_note:
+        logger.debug("Trying to add note describing replication details in the target project.")
+
+        # adding note describing the replication details
+        logger.debug("Adding a note describing the replication details to the target project.")
+        url = f"{project_url}/drawings"
+        svg = (f'<svg height="24" width="100">'
+               f'<text fill="#000000" fill-opacity="1.0" font-family="TypeWriter" font-size="10.0" font-weight="bold">'
+               f'Server: {escape(target_server_address)}\n'
+               f'Replicated from: {escape(args.source_server)} Project: {escape(project_name)}\n'
+               f'Replicated at: {replication_timestamp}\n'
+               f'</text></svg>')
+        r = session.post(url, json={'x': 0, 'y': 0, 'z': 0, 'svg': svg})
+        if not r.status_code == 201:
+            logger.fatal("Unable to inject a note describing the replication details in the project")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+
+    if args.regenerate_mac_address or args.inject_replication_note:
+        # close target project
+        logger.debug("Close imported project.")
+        url = f"{project_url}/close"
+        r = session.post(url, json={})
+        if not r.status_code == 201 and not r.status_code == 204:
+            logger.fatal("Unable to close imported project on target server.")
+            logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+            raise ProxyError()
+
+    if args.duplicate_target_project:
+        if args.duplicates_per_target_server > 0:
+            # continue numbering across the target servers
+            numbers = itertools.islice(duplicate_numbers, args.duplicates_per_target_server)
+        else:
+            numbers = itertools.count(args.duplicate_start)
+        for duplicate_number in itertools.takewhile(lambda n: n <= args.duplicate_end, numbers):
+            if args.duplicate_name is not None:
+                duplicate_project_name = args.duplicate_name + str(duplicate_number)
+            else:
+                duplicate_project_name = project_name + str(duplicate_number)
+            synchronized_print("Duplicating target project. New name: %s" % duplicate_project_name)
+            url = f"{project_url}/duplicate"
+            json_data = {'name': duplicate_project_name,
+                         'reset_mac_addresses': args.reset_mac_addresses}
+            r = session.post(url, json=json_data)
+            if not r.status_code == 201:
+                logger.fatal("Unable to duplicate project on target server.")
+                logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+                raise ProxyError()
+
+
 def main():
     replication_timestamp = datetime.datetime.now()
 
     # parse arguments
     args = parse_args(sys.argv[1:])
 
-    # parse config file gns3_proxy_config.ini
-    config = configparser.ConfigParser()
-    config.read_file(open(args.config_file))
-    config.read(args.config_file)
-
+    # configure logging before the config file is parsed
     logging.basicConfig(level=getattr(logging, args.log_level),
                         format='%(asctime)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s')
 
+    # parse config file gns3_proxy_config.ini
+    config = configparser.ConfigParser()
+    with open(args.config_file, encoding='utf-8') as config_file:
+        config.read_file(config_file)
+
     # get backend_user
     #
     # description: Username to use to access backend GNS3 server
     # default: admin
-    if config.get('proxy', 'backend_user'):
-        backend_user = config.get('proxy', 'backend_user')
-    else:
-        backend_user = "admin"
+    backend_user = config.get('proxy', 'backend_user', fallback='') or "admin"
 
     # get backend_password
     #
     # description: Password to use to access backend GNS3 server
     # default: password
-    if config.get('proxy', 'backend_password'):
-        backend_password = config.get('proxy', 'backend_password')
-    else:
-        backend_password = "password"
+    backend_password = config.get('proxy', 'backend_password', fallback='') or "password"
 
     # get backend_port
     #
     # description: TCP port to use to access backend GNS3 server
     # default: 3080
-    if config.get('proxy', 'backend_port'):
-        backend_port = config.getint('proxy', 'backend_port')
-    else:
-        backend_port = 3080
+    backend_port = int(config.get('proxy', 'backend_port', fallback='') or 3080)
 
     # read servers from config
-    if config.items('servers'):
-        config_servers = dict()
-        server_items = config.items('servers')
-        for key, value in server_items:
-            try:
-                ip_address(value)
-            except ValueError:
-                logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)" % value)
-                raise ProxyError()
-            config_servers[key] = value
+    server_items = config.items('servers')
+    for key, value in server_items:
+        if not is_ip_address(value):
+            logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)", value)
+            raise ProxyError()
+    config_servers = dict(server_items)
+
+    logger.debug("Config backend_user: %s", backend_user)
+    logger.debug("Config backend_password: %s", backend_password)
+    logger.debug("Config backend_port: %s", backend_port)
+
+    logger.debug("Config servers: %s", config_servers)
+
+    # compile regular expressions used to match projects, target servers and mac addresses only once
+    if args.project_name:
+        project_name_pattern = re.compile(args.project_name)
+    else:
+        project_name_pattern = None
+    target_server_pattern = re.compile(args.target_server)
+    if args.regenerate_mac_address:
+        mac_address_pattern = re.compile(args.regenerate_mac_address)
     else:
-        config_servers = None
+        mac_address_pattern = None
 
-    logger.debug("Config backend_user: %s" % backend_user)
-    logger.debug("Config backend_password: %s" % backend_password)
-    logger.debug("Config backend_port: %s" % backend_port)
-    logger.debug("Config default_server: %s" % config_servers)
+    username = backend_user
+    password = backend_password
 
-    logger.debug("Config servers: %s" % config_servers)
+    # share a session to keep the connections to the source and target servers alive across all
+    # requests needed to replicate the projects, idempotent requests (GET, PUT, DELETE) are retried if a backend is
+    # temporarily unavailable, POST requests, e.g., to import or duplicate projects, are not retried
+    session = requests.Session()
+    session.auth = (username, password)
+    retries = Retry(total=5, backoff_factor=0.25, status_forcelist=(502, 503, 504), raise_on_status=False)
+    session.mount('http://', HTTPAdapter(pool_connections=len(config_servers) or 1, max_retries=retries))
 
     try:
-        username = backend_user
-        password = backend_password
 
         # source handling
 
         # get source server IP
         if args.source_server in config_servers:
             src_server = config_servers[args.source_server]
-            logger.debug("Source server will be %s:%s" % (
-                src_server, backend_port))
+            logger.debug("Source server will be %s:%s", src_server, backend_port)
         else:
             logger.fatal("Source server not found in config.")
             raise ProxyError()
 
-        base_src_api_url = "http://" + src_server + ":" + str(backend_port) + "/v2"
+        base_src_api_url = f"http://{src_server}:{backend_port}/v2"
 
-        logger.debug("Searching source project UUIDs")
         projects = list()
-        url = base_src_api_url + '/projects'
-        r = requests.get(url, auth=(username, password))
-        if not r.status_code == 200:
-            logger.fatal("Could not list projects.")
-            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-            raise ProxyError()
+        if args.project_id:
+            # get the project directly instead of searching it in the list of all projects
+            logger.debug("Getting source project UUID")
+            url = f"{base_src_api_url}/projects/{args.project_id}"
+            r = session.get(url)
+            if r.status_code == 200:
+                project = r.json()
+                logger.debug('matched UUID of: %s', project)
+                projects.append(project)
+            elif not r.status_code == 404:
+                logger.fatal("Could not get project.")
+                logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+                raise ProxyError()
         else:
-            project_results = json.loads(r.text)
-            for project in project_results:
-                if args.project_id:
-                    if args.project_id == project['project_id']:
-                        logger.debug('matched UUID of: %s' % project)
-                        projects.append(project)
-                else:
-                    if re.fullmatch(args.project_name, project['name']):
-                        logger.debug('matched name of: %s' % project)
+            logger.debug("Searching source project UUIDs")
+            url = f"{base_src_api_url}/projects"
+            r = session.get(url)
+            if not r.status_code == 200:
+                logger.fatal("Could not list projects.")
+                logger.debug("Status code: %s Text: %s", r.status_code, r.text)
+                raise ProxyError()
+            else:
+                project_results = r.json()
+                for project in project_results:
+                    if project_name_pattern.fullmatch(project['name']):
+                        logger.debug('matched name of: %s', project)
                         projects.append(project)
 
         if len(projects) == 0:
             logger.fatal("Specified project not found.")
             raise ProxyError()
 
+        # target handling
+
+        # Try to find match for target server in config
+        target_server_addresses = list()
+        if len(config_servers) > 0:
+            for key in config_servers:
+                if target_server_pattern.fullmatch(key):
+                    logger.debug("Target server found: %s (%s) using provided match: %s", key, config_servers[key],
+                                 args.target_server)
+                    if key == args.source_server:
+                        logger.debug("Target server %s is the same as the source server %s . Filtered out.",
+                                     key, args.source_server)
+                    else:
+                        target_server_addresses.append(config_servers[key])
+        else:
+            logger.fatal("No servers defined in config. Could not select target server.")
+            raise ProxyError()
+
+        if len(target_server_addresses) == 0:
+            logger.fatal("No target servers found using match: %s. Could not select target server.",
+                         args.target_server)
+            raise ProxyError()
+
+        if args.duplicate_target_project and args.duplicates_per_target_server > 0:
+            # duplicate numbers are distributed across the targets in order, handle them one after another
+            max_workers = 1
+        else:
+            max_workers = min(REPLICATION_WORKERS, len(target_server_addresses))
+
         for project in projects:
             project_uuid = project['project_id']
             project_name = project['name']
             print("#### Replicating project: %s (%s)" % (project_name, project_uuid))
-            tmp_file = tempfile.TemporaryFile()
-
-            # close source project
-            logger.debug("Closing source project")
-            url = base_src_api_url + '/projects/' + project_uuid + "/close"
-            data = "{}"
-            r = requests.post(url, data, auth=(username, password))
-            if not r.status_code == 201 and not r.status_code == 204:
-                logger.fatal("Unable to close source project. Source project does not exist or is corrupted?")
-                logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                raise ProxyError()
-
-            # export source project
-            logger.debug("Exporting source project")
-            url = base_src_api_url + '/projects/' + project_uuid + "/export?"
-            if args.include_base_images:
-                url = url + "include_images=yes"
-            else:
-                url = url + "include_images=no"
-            if args.include_snapshots:
-                url = url + "&include_snapshots=yes"
-            else:
-                url = url + "&include_snapshots=no"
-            if args.reset_mac_addresses:
-                url = url + "&reset_mac_addresses=yes"
-            else:
-                url = url + "&reset_mac_addresses=no"
-            url = url + "&compression=" + args.compression
-            r = requests.get(url, stream=True, auth=(username, password))
-            if r.status_code == 200:
-                r.raw.decode_content = True
-                shutil.copyfileobj(r.raw, tmp_file)
-                logger.debug("Project exported to file: %s (%s bytes)" % (tmp_file.name, tmp_file.tell()))
-            else:
-                logger.fatal("Unable to export project from source server.")
-                logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                raise ProxyError()
-
-            # target handling
-
-            # Try to find match for target server in config
-            target_server_addresses = list()
-            if len(config_servers) > 0:
-                for key in config_servers:
-                    if re.fullmatch(args.target_server, key):
-                        logger.debug("Target server found: %s (%s) using provided match: %s" % (key,
-                                                                                                config_servers[key],
-                                                                                                args.target_server))
-                        if key == args.source_server:
-                            logger.debug("Target server %s is the same as the source server %s . Filtered out."
-                                         % (key, args.source_server))
-                        else:
-                            target_server_addresses.append(config_servers[key])
-            else:
-                logger.fatal("No servers defined in config. Could not select target server.")
-                raise ProxyError()
-
-            if len(target_server_addresses) == 0:
-                logger.fatal("No target servers found using match: %s. Could not select target server."
-                             % args.target_server)
-                raise ProxyError()
-
-            duplicate_number = args.duplicate_start
-            for target_server_address in target_server_addresses:
-                print("    #### Replicating project: %s (%s) to server: %s " % (
-                    project_name, project_uuid, target_server_address))
-                base_dst_api_url = "http://" + target_server_address + ":" + str(backend_port) + "/v2"
-
-                logger.debug("Checking if target project exists...")
-                url = base_dst_api_url + '/projects/' + project_uuid
-                r = requests.get(url, auth=(username, password))
-                if r.status_code == 200:
-                    if args.force:
-                        print("         Project UUID: %s already exists on server: %s overwriting it."
-                              % (project_uuid, target_server_address))
-                    else:
-                        print("         WARNING: Project UUID: %s already exists on server: %s. Use --force"
-                              " to overwrite." % (project_uuid, target_server_address))
-                        continue
-
-                # close destination project
-                logger.debug("Closing destination project")
-                url = base_dst_api_url + '/projects/' + project_uuid + "/close"
-                data = "{}"
-                r = requests.post(url, data, auth=(username, password))
-                if not r.status_code == 201 and not r.status_code == 204:
-                    if r.status_code == 404:
-                        logger.debug("Destination project did not exist before, not closed")
-                    else:
-                        raise ProxyError()
-
-                if args.delete_target_project:
-                    if args.force:
-                        logger.debug("Deleting destination project")
-                        r = requests.delete(base_dst_api_url + '/projects/' + project_uuid,
-                                            auth=(username, password))
-                        if not r.status_code == 204:
-                            if r.status_code == 404:
-                                logger.debug("Destination project did not exist before, not deleted")
-                            else:
-                                logger.fatal("unable to delete project")
-                                logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                raise ProxyError()
-                    else:
-                        print(
-                            "        WARNING: Project UUID %s to delete found on server: %s, use --force to"
-                            " really remove it." % (project_uuid, target_server_address))
-                        continue
-
-                logger.debug("Importing destination project")
-                # import project
-                url = base_dst_api_url + '/projects/' + project_uuid + "/import"
-                tmp_file.seek(0)
-                files = {'file': tmp_file}
-                r = requests.post(url, files=files, auth=(username, password))
-                if not r.status_code == 201:
-                    if r.status_code == 403:
-                        logger.fatal("Forbidden to import project on target server.")
-                        raise ProxyError()
-                    elif r.status_code == 409:
-                        logger.fatal("Project already partially created. Previous import seems to be interrupted. "
-                                     "Try to restart GNS3 target server backend or use log level debug and check"
-                                     "error status code and reason.")
-                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                        raise ProxyError()
-                    else:
-                        logger.fatal("Unable to import project on target server.")
-                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                        raise ProxyError()
-
-                if args.regenerate_mac_address or args.inject_replication_note:
-                    # open target project
-                    logger.debug("Open imported project to make changes.")
-                    url = base_dst_api_url + '/projects/' + project_uuid + "/open"
-                    data = "{}"
-                    r = requests.post(url, data, auth=(username, password))
-                    if not r.status_code == 201:
-                        logger.fatal("Unable to open imported project on target server.")
-                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                        raise ProxyError()
-
-                # check if we need to change MAC addresses in the target project
-                if args.regenerate_mac_address:
-                    logger.debug("Trying to regenerate specified MAC addresses in target project.")
-
-                    # getting target project nodes and search for mac address changes
-                    logger.debug("Getting destination project nodes")
-                    url = base_dst_api_url + '/projects/' + project_uuid + "/nodes"
-                    r = requests.get(url, auth=(username, password))
-                    if not r.status_code == 200:
-                        logger.fatal("Unable to get nodes from imported project on target server.")
-                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                        raise ProxyError()
-                    else:
-                        nodes = json.loads(r.text)
-                        for node in nodes:
-                            if 'properties' in node:
-                                if 'mac_address' in node['properties']:
-                                    if re.fullmatch(args.regenerate_mac_address,
-                                                    node['properties']['mac_address']):
-                                        logger.debug(
-                                            'Found MAC address that needs to be changed: %s using match: %s'
-                                            % (node['properties']['mac_address'],
-                                               args.regenerate_mac_address))
-                                        mac_address = "02:01:00:%02x:%02x:%02x" % (random.randint(0, 255),
-                                                                                   random.randint(0, 255),
-                                                                                   random.randint(0, 255))
-                                        # changing mac address in target project node
-                                        print("         Changing mac address of node: %s from: %s to: %s"
-                                              % (node['name'], node['properties']['mac_address'], mac_address))
-                                        url = base_dst_api_url + '/projects/' + project_uuid + "/nodes/" \
-                                              + node['node_id']
-                                        data = '{ "properties": { "mac_address": "' + mac_address + '" } }'
-                                        r = requests.put(url, data, auth=(username, password))
-                                        if not r.status_code == 200:
-                                            logger.fatal(
-                                                "Unable to change mac address for node: %s in target project."
-                                                % node['name'])
-                                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                            raise ProxyError()
-                                if 'mac_addr' in node['properties']:
-                                    if re.fullmatch(args.regenerate_mac_address,
-                                                    node['properties']['mac_addr']):
-                                        logger.debug(
-                                            'Found MAC address that needs to be changed: %s using match: %s'
-                                            % (node['properties']['mac_addr'],
-                                               args.regenerate_mac_address))
-                                        mac_addr = "0201.00%02x.%02x%02x" % (random.randint(0, 255),
-                                                                             random.randint(0, 255),
-                                                                             random.randint(0, 255))
-                                        # changing mac address in target project node
-                                        print("         Changing mac address of node: %s from: %s to: %s"
-                                              % (node['name'], node['properties']['mac_addr'], mac_addr))
-                                        url = base_dst_api_url + '/projects/' + project_uuid + "/nodes/" \
-                                              + node['node_id']
-                                        data = '{ "properties": { "mac_addr": "' + mac_addr + '" } }'
-                                        r = requests.put(url, data, auth=(username, password))
-                                        if not r.status_code == 200:
-                                            logger.fatal(
-                                                "Unable to change mac address for node: %s in target project."
-                                                % node['name'])
-                                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                            raise ProxyError()
-
-                # check if we need to inject a note describing the replication details in the project
-                if args.inject_replication_note:
-                    logger.debug("Trying to add note describing replication details in the target project.")
-
-                    # open target project
-                    logger.debug("Open imported project.")
-                    url = base_dst_api_url + '/projects/' + project_uuid + "/open"
-                    data = "{}"
-                    r = requests.post(url, data, auth=(username, password))
-                    if not r.status_code == 201:
-                        logger.fatal("Unable to open imported project on target server.")
-                        raise ProxyError()
-
-                    # adding note describing the replication details
-                    logger.debug("Adding a note describing the replication details to the target project.")
-                    url = base_dst_api_url + '/projects/' + project_uuid + "/drawings"
-                    data = '{ "x": 0, "y": 0, "z": 0, ' \
-                           '"svg": "<svg height=\\"24\\" width=\\"100\\">' \
-                           '<text fill=\\"#000000\\" fill-opacity=\\"1.0\\" font-family=\\"TypeWriter\\"' \
-                           ' font-size=\\"10.0\\" font-weight=\\"bold\\">' \
-                           'Server: ' + str(target_server_address).replace('"', '\\"') + '\\n' \
-                                                                                         'Replicated from: ' + str(
-                        args.source_server).replace('"', '\\"') \
-                           + ' ' \
-                             'Project: ' \
-                           + str(args.project).replace('"',
-                                                       '\\"') + '\\n' \
-                                                                'Replicated at: ' + str(
-                        replication_timestamp).replace('"', '\\"') + '\\n' \
-                                                                     '</text></svg>" }'
-                    r = requests.post(url, data, auth=(username, password))
-                    if not r.status_code == 201:
-                        logger.fatal("Unable to inject a note describing the replication details in the project")
-                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                        raise ProxyError()
-
-                if args.regenerate_mac_address or args.inject_replication_note:
-                    # close target project
-                    logger.debug("Close imported project.")
-                    url = base_dst_api_url + '/projects/' + project_uuid + "/close"
-                    data = "{}"
-                    r = requests.post(url, data, auth=(username, password))
-                    if not r.status_code == 201 and not r.status_code == 204:
-                        logger.fatal("Unable to close imported project on target server.")
-                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                        raise ProxyError()
-
-                if args.duplicate_target_project:
-                    if args.duplicates_per_target_server > 0:
-                        duplicates_created_on_server = 0
-                    else:
-                        duplicate_number = args.duplicate_start
-                    while duplicate_number <= args.duplicate_end:
-                        if args.duplicate_name is not None:
-                            duplicate_project_name = args.duplicate_name + str(duplicate_number)
-                        else:
-                            duplicate_project_name = project_name + str(duplicate_number)
-                        print("Duplicating target project. New name: %s" % duplicate_project_name)
-                        url = base_dst_api_url + '/projects/' + project_uuid + "/duplicate"
-                        json_data = {'name': duplicate_project_name,
-                                     'reset_mac_addresses': args.reset_mac_addresses}
-                        data = json.dumps(json_data)
-                        r = requests.post(url, data, auth=(username, password))
-                        if not r.status_code == 201:
-                            logger.fatal("Unable to duplicate project on target server.")
-                            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                            raise ProxyError()
-                        duplicate_number = duplicate_number + 1
-                        if args.duplicates_per_target_server > 0:
-                            duplicates_created_on_server = duplicates_created_on_server + 1
-                            if duplicates_created_on_server >= args.duplicates_per_target_server:
-                                break
-
-            # project is replicated close temp file
-            tmp_file.close()
+            # export the project to a named temporary file, allowing each target server to read it independently
+            export_file = tempfile.NamedTemporaryFile(delete=False)
+            export_filename = export_file.name
+            try:
+                duplicate_numbers = itertools.count(args.duplicate_start)
+
+                # target servers are independent of each other, replicate the project to them concurrently and
+                # check the target projects while the source project is exported by a separate worker, which keeps
+                # the number of target servers handled at the same time at max_workers
+                with interruptible_executor(1) as export_executor, interruptible_executor(max_workers) as executor:
+                    export_future = export_executor.submit(export_project, project_uuid, export_file,
+                                                           base_src_api_url, session, args)
+                    futures = [executor.submit(replicate_project_to_target, project, target_server_address,
+                                               export_filename, export_future, session, args, backend_port,
+                                               replication_timestamp, duplicate_numbers, mac_address_pattern)
+                               for target_server_address in target_server_addresses]
+                    export_future.result()
+                    for future in futures:
+                        future.result()
+            finally:
+                # project is replicated, remove the exported project
+                export_file.close()
+                os.remove(export_filename)
 
         print("Done.")
 
     except KeyboardInterrupt:
         pass
 
+    finally:
+        session.close()
+
 
 if __name__ == '__main__':
     main()
@@ -13,12 +13,18 @@ import argparse
 import configparser
 import json
 import logging
+import os
 import re
+import socket
 import sys
-from ipaddress import ip_address
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from packaging import version
 
 import requests
+from requests.adapters import HTTPAdapter
 
 VERSION = (0, 4)
 __version__ = '.'.join(map(str, VERSION[0:2]))
@@ -31,6 +37,12 @@ __license__ = 'BSD'
 
 logger = logging.getLogger(__name__)
 
+# serializes console output of target servers handled concurrently
+print_lock = threading.Lock()
+
+# set on Ctrl-C to stop the workers still running, as they are not waited for
+stop_event = threading.Event()
+
 PY3 = sys.version_info[0] == 3
 
 if PY3:  # pragma: no cover
@@ -47,18 +59,89 @@ if PY3:  # pragma: no cover
 DEFAULT_CONFIG_FILE = 'gns3_proxy_config.ini'
 DEFAULT_LOG_LEVEL = 'INFO'
 DEFAULT_FORCE = False
+DEFAULT_CACHE_TTL = 0
+
+# Templates of the source server can be cached between runs, e.g., when replicating templates in batches
+SOURCE_TEMPLATES_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gns3_proxy')
+
+# Number of target servers a template is replicated to concurrently
+REPLICATION_WORKERS = 8
+
+# Sections of the settings of GNS3 <2.2 containing the configuration of each node type and the
+# settings of the node type that are not supported anymore in GNS3 >=2.2
+NODE_TYPE_SETTINGS = {
+    'cloud': ('Builtin', 'cloud_nodes', ()),
+    'ethernet_hub': ('Builtin', 'ethernet_hubs', ()),
+    'ethernet_switch': ('Builtin', 'ethernet_switches', ()),
+    'docker': ('Docker', 'containers', ()),
+    'dynamips': ('Dynamips', 'routers', ('chassis', 'iomem')),
+    'iou': ('IOU', 'devices', ()),
+    'qemu': ('Qemu', 'vms', ('acpi_shutdown',)),
+    'vmware': ('VMware', 'vms', ()),
+    'vpcs': ('VPCS', 'nodes', ()),
+    'virtualbox': ('VirtualBox', 'vms', ()),
+}
 
 
 class ProxyError(Exception):
     pass
 
 
+def _expect(r, ok, error_msg, allow_404=False):
+    """Check the status code of a GNS3 API response.
+
+    Returns True if the status code is one of ``ok``. If ``allow_404`` is set, a missing resource is not treated as an
+    error and False is returned. Otherwise ``error_msg`` is logged and ProxyError is raised."""
+    status_code = r.status_code
+    if status_code in ok:
+        return True
+    if allow_404 and status_code == 404:
+        logger.debug("Not found: %s, skipping", r.url)
+        return False
+    logger.fatal(error_msg)
+    logger.debug("HTTP %d on %s Text: %s", status_code, r.url, r.text[:200])
+    raise ProxyError()
+
+
+def synchronized_print(message):
+    """Print a message without interleaving it with output of other threads."""
+    with print_lock:
+        print(message)
+
+
+def check_stopped():
+    """Raise ProxyError if the run was interrupted, called by workers between API calls."""
+    if stop_event.is_set():
+        raise ProxyError()
+
+
+@contextmanager
+def interruptible_executor(max_workers):
+    """Provide a ThreadPoolExecutor that is shut down like in a with statement, unless Ctrl-C was pressed.
+
+    On Ctrl-C running workers are not waited for, stop_event is set instead to let them and the workers not
+    started yet stop at their next check_stopped()."""
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    interrupted = False
+    try:
+        yield executor
+    except KeyboardInterrupt:
+        stop_event.set()
+        interrupted = True
+        raise
+    finally:
+        executor.shutdown(wait=not interrupted)
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser(
         description='gns3_proxy_replicate_templates.py v%s Replicates templates on GNS3 proxy backends.' % __version__,
         epilog='gns3_proxy not working? Report at: %s/issues/new' % __homepage__
     )
     # Argument names are ordered alphabetically.
+    parser.add_argument('--cache-ttl', type=int, default=DEFAULT_CACHE_TTL,
+                        help='Reuse the templates of the source server fetched by a previous run during the last '
+                             'CACHE_TTL seconds. Default: 0, always request the templates.')
     parser.add_argument('--config-file', type=str, default=DEFAULT_CONFIG_FILE,
                         help='Location of the gns3_proxy config file. Default: gns3_proxy_config.ini.')
     parser.add_argument('--log-level', type=str, default=DEFAULT_LOG_LEVEL,
@@ -84,14 +167,149 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
+def is_ip_address(value):
+    """Return whether value is a textual IPv4 or IPv6 address."""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, value)
+            return True
+        except OSError:
+            pass
+    return False
+
+
+def load_source_templates_cache(cache_file, cache_ttl):
+    """Return the cached templates of the source server, or None if they are missing or older than cache_ttl."""
+    try:
+        if time.time() - os.path.getmtime(cache_file) >= cache_ttl:
+            return None
+        with open(cache_file, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_source_templates_cache(cache_file, template_results):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(template_results, f)
+    except OSError as e:
+        logger.debug("Could not write source templates cache %s: %s", cache_file, e)
+
+
+def get_target_templates(target_server_address, session, backend_port):
+    """Check that a target server supports the GNS3 2.2 template API and return its templates."""
+    check_stopped()
+    base_dst_api_url = f"http://{target_server_address}:{backend_port}/v2"
+    url = f"{base_dst_api_url}/version"
+    r = session.get(url)
+    _expect(r, {200}, "Could not connect to target server. Could not determine its version.")
+    server_version = r.json()['version']
+    if version.parse(server_version) < version.parse("2.2.0"):
+        logger.fatal("Target server must use GNS3 >= 2.2. Template format has changed. You can use"
+                     " gns3_proxy_manage_templates.py to export templates from 2.1, automatically"
+                     " convert them to GNS3 2.2 format and import them to a new GNS3 2.2 server.")
+        raise ProxyError()
+
+    r = session.get(f"{base_dst_api_url}/templates")
+    _expect(r, {200}, "Could not get status of templates from server %s." % target_server_address)
+    return r.json()
+
+
+def replicate_template_to_target(template, target_server_address, src_server, session, args, backend_port,
+                                 target_templates):
+    """Import the template on a target server. Templates with the same name or id are deleted if --force is given.
+
+    target_templates holds the templates of each target server, indexed by the target server address, and is kept
+    up to date to replicate further templates."""
+    template_name = template['name']
+    template_id = template['template_id']
+
+    logger.debug("    #### Replicating template: %s to server: %s", template_name, target_server_address)
+    templates_url = f"http://{target_server_address}:{backend_port}/v2/templates"
+    target_template_results = target_templates[target_server_address]
+
+    logger.debug("Checking if target template name or id exists...")
+    target_templates_by_name = list()
+    target_templates_by_id = list()
+    for target_template in target_template_results:
+        if target_template['name'] == template_name:
+            logger.debug("Template name: %s already exists on server %s", target_template['name'],
+                         target_server_address)
+            target_templates_by_name.append(target_template)
+        if target_template['template_id'] == template_id:
+            logger.debug("Template id: %s already exists on server %s", target_template['template_id'],
+                         target_server_address)
+            target_templates_by_id.append(target_template)
+    if len(target_templates_by_name) > 1:
+        logger.fatal("Multiple templates matched name %s on server %s. "
+                     "Import can only be used for single template.", template_name, target_server_address)
+        raise ProxyError()
+    if len(target_templates_by_id) > 1:
+        logger.fatal("Multiple templates matched id %s on server %s. "
+                     "Import can only be used for single template.", template_id, target_server_address)
+        raise ProxyError()
+
+    # an identical template (including its id) does not need to be deleted and imported again
+    if target_templates_by_name and target_templates_by_name[0] == template:
+        synchronized_print("#### Template %s is already up to date on server: %s, skipping"
+                           % (template_name, target_server_address))
+        return
+
+    # a template matching both name and id only needs to be deleted once
+    templates_to_delete = [('name', 'name', target_template) for target_template in target_templates_by_name]
+    templates_to_delete += [('id', 'template_id', target_template) for target_template in target_templates_by_id
+                            if target_template not in target_templates_by_name]
+    for match, key, target_template in templates_to_delete:
+        if not args.force:
+            logger.fatal("Template %s: %s already exists on server %s. Use --force to overwrite it"
+                         " during import.", match, target_template[key], target_server_address)
+            raise ProxyError()
+
+        synchronized_print("#### Forcing deletion of template %s %s on server: %s" % (
+            match, target_template[key], target_server_address))
+
+        logger.debug("Deleting template %s %s on server: %s", match, target_template[key], target_server_address)
+        r = session.delete(f"{templates_url}/{target_template['template_id']}")
+        if r.status_code == 404:
+            logger.debug("Template did not exist before, not deleted")
+        else:
+            _expect(r, {204}, "unable to delete template")
+            synchronized_print("#### Deleted template %s %s on server: %s"
+                               % (match, target_template[key], target_server_address))
+        target_template_results.remove(target_template)
+
+    logger.debug("Importing template")
+    # import template
+    r = session.post(templates_url, json=template)
+    if r.status_code == 403:
+        logger.fatal("Forbidden to import template on target server.")
+        logger.debug("HTTP %d on %s Text: %s", r.status_code, r.url, r.text[:200])
+        raise ProxyError()
+    _expect(r, {201}, "Unable to import template on target server.")
+    target_template_results.append(r.json())
+    synchronized_print("#### Template %s replicated from server: %s to server: %s"
+                       % (template_name, src_server, target_server_address))
+
+
+def replicate_templates_to_target(templates, target_server_address, src_server, session, args, backend_port,
+                                  target_templates):
+    """Replicate the templates one after another to a target server."""
+    for template in templates:
+        check_stopped()
+        replicate_template_to_target(template, target_server_address, src_server, session, args, backend_port,
+                                     target_templates)
+
+
 def main():
     # parse arguments
     args = parse_args(sys.argv[1:])
 
     # parse config file gns3_proxy_config.ini
     config = configparser.ConfigParser()
-    config.read_file(open(args.config_file))
-    config.read(args.config_file)
+    with open(args.config_file, encoding='utf-8') as config_file:
+        config.read_file(config_file)
 
     logging.basicConfig(level=getattr(logging, args.log_level),
                         format='%(asctime)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s')
@@ -124,355 +342,187 @@ def main():
         backend_port = 3080
 
     # read servers from config
-    if config.items('servers'):
-        config_servers = dict()
-        server_items = config.items('servers')
-        for server, value in server_items:
-            try:
-                ip_address(value)
-            except ValueError:
-                logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)" % value)
-                raise ProxyError()
-            config_servers[server] = value
-    else:
-        config_servers = None
+    server_items = config.items('servers')
+    for server, value in server_items:
+        if not is_ip_address(value):
+            logger.fatal("server config %s is not a valid IP address (e.g., 1.2.3.4)", value)
+            raise ProxyError()
+    config_servers = dict(server_items)
 
-    logger.debug("Config backend_user: %s" % backend_user)
-    logger.debug("Config backend_password: %s" % backend_password)
-    logger.debug("Config backend_port: %s" % backend_port)
+    logger.debug("Config backend_user: %s", backend_user)
+    logger.debug("Config backend_password: %s", backend_password)
+    logger.debug("Config backend_port: %s", backend_port)
+
+    logger.debug("Config servers: %s", config_servers)
+
+    # compile regular expressions used to match templates and target servers only once
+    template_name_pattern = re.compile(args.template_name)
+    target_server_pattern = re.compile(args.target_server)
+
+    username = backend_user
+    password = backend_password
+
+    # share a session to keep the connections to the source and target servers alive across all templates
+    session = requests.Session()
+    session.auth = (username, password)
+    session.mount('http://', HTTPAdapter(pool_connections=len(config_servers) or 1))
 
-    logger.debug("Config servers: %s" % config_servers)
     try:
-        username = backend_user
-        password = backend_password
 
         # get source server IP
         if args.source_server in config_servers:
             src_server = config_servers[args.source_server]
-            logger.debug("Source server will be %s:%s" % (
-                src_server, backend_port))
+            logger.debug("Source server will be %s:%s", src_server, backend_port)
         else:
             logger.fatal("Source server not found in config.")
             raise ProxyError()
 
-        base_src_api_url = "http://" + src_server + ":" + str(backend_port) + "/v2"
-
-        url = base_src_api_url + '/version'
-        r = requests.get(url, auth=(username, password))
-        if r.status_code == 200:
-            version_results = json.loads(r.text)
-            server_version = version_results['version']
-            if version.parse(server_version) < version.parse("2.2.0"):
-                # logger.fatal("Target server must use GNS3 >= 2.2. Template format has changed. See GNS3 "
-                #              "2.2 installation documentation, for steps to migrate GNS3 server from 2.1 "
-                #              "to 2.2.")
-                # raise ProxyError()
-
-                print("Source server is running GNS3 <2.2 (%s) using old appliance template API" %
-                      server_version)
-                src_new_template_api = False
-            else:
-                print("Source server is running GNS3 >=2.2 (%s) using new template API" %
-                      server_version)
-                src_new_template_api = True
+        base_src_api_url = f"http://{src_server}:{backend_port}/v2"
+
+        url = f"{base_src_api_url}/version"
+        r = session.get(url)
+        _expect(r, {200}, "Could not connect to source server. Could not determine its version.")
+        version_results = r.json()
+        server_version = version_results['version']
+        if version.parse(server_version) < version.parse("2.2.0"):
+            # logger.fatal("Target server must use GNS3 >= 2.2. Template format has changed. See GNS3 "
+            #              "2.2 installation documentation, for steps to migrate GNS3 server from 2.1 "
+            #              "to 2.2.")
+            # raise ProxyError()
+
+            print("Source server is running GNS3 <2.2 (%s) using old appliance template API" %
+                  server_version)
+            src_new_template_api = False
         else:
-            logger.fatal("Could not connect to target server. Could not determine its version.")
-            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-            raise ProxyError()
+            print("Source server is running GNS3 >=2.2 (%s) using new template API" %
+                  server_version)
+            src_new_template_api = True
 
         logger.debug("Searching source templates")
-        templates = list()
         if src_new_template_api:
-            url = base_src_api_url + '/templates'
+            endpoint = "templates"
         else:
-            url = base_src_api_url + '/appliances'
-
-        r = requests.get(url, auth=(username, password))
-        if not r.status_code == 200:
-            logger.fatal("Could not list templates.")
-            logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-            raise ProxyError()
-        else:
-            template_results = json.loads(r.text)
-            for template in template_results:
-                if re.fullmatch(args.template_name, template['name']):
-                    logger.debug('matched template: %s' % template['name'])
-
-                    # skip builtin templates like Cloud, NAT, VPCS, Ethernet switch, Ethernet hub, Frame Relay switch,
-                    # ATM switch
-                    if template['builtin']:
-                        print("#### Skipping builtin template: %s" % template['name'])
-                        continue
-
-                    if not src_new_template_api:
-                        # old <2.2 GNS3 API did not include config of the template in appliance
-                        # definition needs to be extracted from settings
-                        url = base_src_api_url + '/settings'
-                        r = requests.get(url, auth=(username, password))
-                        if r.status_code == 200:
-                            settings_results = json.loads(r.text)
-                            if template['node_type'] == "cloud":
-                                for cloud_node in settings_results['Builtin']['cloud_nodes']:
-                                    if cloud_node['name'] == template['name']:
-                                        template.update(cloud_node)
-
-                            elif template['node_type'] == "ethernet_hub":
-                                for ethernet_hub_node in settings_results['Builtin']['ethernet_hubs']:
-                                    if ethernet_hub_node['name'] == template['name']:
-                                        template.update(ethernet_hub_node)
-
-                            elif template['node_type'] == "ethernet_switch":
-                                for ethernet_switch_node in \
-                                        settings_results['Builtin']['ethernet_switches']:
-                                    if ethernet_switch_node['name'] == template['name']:
-                                        template.update(ethernet_switch_node)
-
-                            elif template['node_type'] == "docker":
-                                for container_node in settings_results['Docker']['containers']:
-                                    if container_node['name'] == template['name']:
-                                        template.update(container_node)
-
-                            elif template['node_type'] == "dynamips":
-                                for router_node in settings_results['Dynamips']['routers']:
-                                    if router_node['name'] == template['name']:
-                                        # 'chassis' and 'iomem' not supported in GNS3 >=2.2
-                                        router_node.pop('chassis', None)
-                                        router_node.pop('iomem', None)
-                                        template.update(router_node)
-
-                            elif template['node_type'] == "iou":
-                                for iou_node in settings_results['IOU']['devices']:
-                                    if iou_node['name'] == template['name']:
-                                        template.update(iou_node)
-
-                            elif template['node_type'] == "qemu":
-                                for vm_node in settings_results['Qemu']['vms']:
-                                    if vm_node['name'] == template['name']:
-                                        # 'acpi_shutdown' not supported in GNS3 >=2.2
-                                        vm_node.pop('acpi_shutdown', None)
-                                        template.update(vm_node)
-
-                            elif template['node_type'] == "vmware":
-                                for vmware_node in settings_results['VMware']['vms']:
-                                    if vmware_node['name'] == template['name']:
-                                        template.update(vmware_node)
-
-                            elif template['node_type'] == "vpcs":
-                                for vpc_node in settings_results['VPCS']['nodes']:
-                                    if vpc_node['name'] == template['name']:
-                                        template.update(vpc_node)
-
-                            elif template['node_type'] == "virtualbox":
-                                for virtualbox_node in settings_results['VirtualBox']['vms']:
-                                    if virtualbox_node['name'] == template['name']:
-                                        template.update(virtualbox_node)
-
-                            else:
-                                logger.fatal(
-                                    "Template type %s of template %s not supported. Cannot be "
-                                    "converted."
-                                    % (template['node_type'], template['name']))
-                                raise ProxyError()
-
-                        else:
-                            logger.fatal(
-                                "Could not get settings to export template to new format for %s."
-                                % template['name'])
-                            raise ProxyError()
-
-                        # old <2.2 GNS3 API used appliance_id and node_type, needs to be
-                        # converted to be able to import template to 2.2
-
-                        # 'appliance_id' is now 'template_id' in GNS3 2.2
-                        # 'node_type' is now 'template_type' in GNS3 2.2
-                        template['template_id'] = template.pop('appliance_id')
-                        template['template_type'] = template.pop('node_type')
-
-                        # platform could be null is old GNS3 2.1 templates, GNS3 2.2 only allows the following:
-                        # None is not one of [\'aarch64\', \'alpha\', \'arm\', \'cris\', \'i386\', \'lm32\', \'m68k\',
-                        # \'microblaze\', \'microblazeel\', \'mips\', \'mips64\', \'mips64el\', \'mipsel\', \'moxie\',
-                        # \'or32\', \'ppc\', \'ppc64\', \'ppcemb\', \'s390x\', \'sh4\', \'sh4eb\', \'sparc\',
-                        # \'sparc64\', \'tricore\', \'unicore32\', \'x86_64\', \'xtensa\', \'xtensaeb\', \'\']"
-                        if 'platform' in template:
-                            if template['platform'] is None:
-                                template.pop('platform')
-
-                    templates.append(template)
+            endpoint = "appliances"
+
+        cache_file = os.path.join(SOURCE_TEMPLATES_CACHE_DIR,
+                                  f"{src_server.replace(':', '_')}_{backend_port}_{endpoint}.json")
+        template_results = None
+        if args.cache_ttl > 0:
+            template_results = load_source_templates_cache(cache_file, args.cache_ttl)
+            if template_results is not None:
+                logger.debug("Using cached %s of source server from %s", endpoint, cache_file)
+        if template_results is None:
+            r = session.get(f"{base_src_api_url}/{endpoint}")
+            _expect(r, {200}, "Could not list templates.")
+            template_results = r.json()
+            if args.cache_ttl > 0:
+                save_source_templates_cache(cache_file, template_results)
+
+        matched_templates = [template for template in template_results
+                             if template_name_pattern.fullmatch(template['name'])]
+        for template in matched_templates:
+            logger.debug('matched template: %s', template['name'])
+
+            # skip builtin templates like Cloud, NAT, VPCS, Ethernet switch, Ethernet hub, Frame Relay switch,
+            # ATM switch
+            if template['builtin']:
+                print("#### Skipping builtin template: %s" % template['name'])
+        templates = [template for template in matched_templates if not template['builtin']]
 
         if len(templates) == 0:
             logger.fatal("Specified template not found.")
             raise ProxyError()
 
-        for template in templates:
-            template_name = template['name']
-            template_id = template['template_id']
-
-            print("#### Replicating template: %s" % template_name)
-
-            # target handling
-
-            # Try to find match for target server in config
-            target_server_addresses = list()
-            if len(config_servers) > 0:
-                for key in config_servers:
-                    if re.fullmatch(args.target_server, key):
-                        logger.debug("Target server found: %s (%s) using provided match: %s" % (key,
-                                                                                                config_servers[key],
-                                                                                                args.target_server))
-                        if key == args.source_server:
-                            logger.debug("Target server %s is the same as the source server %s . Filtered out."
-                                         % (key, args.source_server))
-                        else:
-                            target_server_addresses.append(config_servers[key])
-            else:
-                logger.fatal("No servers defined in config. Could not select target server.")
-                raise ProxyError()
-
-            if len(target_server_addresses) == 0:
-                logger.fatal("No target servers found using match: %s. Could not select target server."
-                             % args.target_server)
-                raise ProxyError()
-
-            for target_server_address in target_server_addresses:
-                logger.debug("    #### Replicating template: %s to server: %s" % (template_name, target_server_address))
-                base_dst_api_url = "http://" + target_server_address + ":" + str(backend_port) + "/v2"
-                url = base_dst_api_url + '/version'
-                r = requests.get(url, auth=(username, password))
-                if r.status_code == 200:
-                    version_results = json.loads(r.text)
-                    server_version = version_results['version']
-                    if version.parse(server_version) < version.parse("2.2.0"):
-                        logger.fatal("Target server must use GNS3 >= 2.2. Template format has changed. You can use"
-                                     " gns3_proxy_manage_templates.py to export templates from 2.1, automatically"
-                                     " convert them to GNS3 2.2 format and import them to a new GNS3 2.2 server.")
-                        raise ProxyError()
-                else:
-                    logger.fatal("Could not connect to source server. Could not determine its version.")
-                    logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
+        if not src_new_template_api:
+            # old <2.2 GNS3 API did not include config of the template in appliance
+            # definition needs to be extracted from settings, which are the same for all templates
+            url = f"{base_src_api_url}/settings"
+            r = session.get(url)
+            _expect(r, {200}, "Could not get settings to export templates to new format.")
+            settings_results = r.json()
+            # index the settings of each node type by name
+            # sections of node types not installed on the server may be missing
+            settings_by_name = {node_type: {node['name']: node
+                                            for node in settings_results.get(section, {}).get(key, [])}
+                                for node_type, (section, key, _) in NODE_TYPE_SETTINGS.items()}
+
+            for template in templates:
+                if template['node_type'] not in settings_by_name:
+                    logger.fatal("Template type %s of template %s not supported. Cannot be "
+                                 "converted.", template['node_type'], template['name'])
                     raise ProxyError()
 
-                logger.debug("Checking if target template name exists...")
-                url = base_dst_api_url + '/templates'
-                r = requests.get(url, auth=(username, password))
-                if r.status_code == 200:
-                    target_template_name_exists = False
-                    target_template_name_to_delete = None
-                    target_template_results = json.loads(r.text)
-                    for target_template in target_template_results:
-                        if re.fullmatch(template_name, target_template['name']):
-                            logger.debug("Template name: %s already exists on server %s"
-                                         % (target_template['name'], target_server_address))
-                            if target_template_name_exists:
-                                logger.fatal(
-                                    "Multiple templates matched name %s on server %s. "
-                                    "Import can only be used for single template." % (
-                                        template_name, target_server_address))
-                                raise ProxyError()
-                            else:
-                                target_template_name_to_delete = target_template
-                                target_template_name_exists = True
-                    if target_template_name_exists:
-                        if args.force:
-                            print("#### Forcing deletion of template name %s on server: %s" % (
-                                target_template_name_to_delete['name'], target_server_address))
-
-                            logger.debug("Deleting template name %s on server: %s"
-                                         % (target_template_name_to_delete['name'], target_server_address))
-                            r = requests.delete(
-                                base_dst_api_url + '/templates/' + target_template_name_to_delete['template_id'],
-                                auth=(username, password))
-                            if not r.status_code == 204:
-                                if r.status_code == 404:
-                                    logger.debug("Template did not exist before, not deleted")
-                                else:
-                                    logger.fatal("unable to delete template")
-                                    logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                    raise ProxyError()
-                            else:
-                                print("#### Deleted template name %s on server: %s"
-                                      % (target_template_name_to_delete['name'], target_server_address))
-                        else:
-                            logger.fatal(
-                                "Template name: %s already exists on server %s. Use --force to overwrite it"
-                                " during import."
-                                % (target_template_name_to_delete['name'], target_server_address))
-                            raise ProxyError()
-
-                    logger.debug("Checking if target template id exists...")
-                    url = base_dst_api_url + '/templates'
-                    r = requests.get(url, auth=(username, password))
-                    if r.status_code == 200:
-                        target_template_id_exists = False
-                        target_template_id_to_delete = None
-                        target_template_results = json.loads(r.text)
-                        for target_template in target_template_results:
-                            if re.fullmatch(template_id, target_template['template_id']):
-                                logger.debug("Template id: %s already exists on server %s"
-                                             % (target_template['template_id'], target_server_address))
-                                if target_template_id_exists:
-                                    logger.fatal(
-                                        "Multiple templates matched id %s on server %s. "
-                                        "Import can only be used for single template." % (
-                                            template_id, target_server_address))
-                                    raise ProxyError()
-                                else:
-                                    target_template_id_to_delete = target_template
-                                    target_template_id_exists = True
-                        if target_template_id_exists:
-                            if args.force:
-                                print("#### Forcing deletion of template id %s on server: %s" % (
-                                    target_template_id_to_delete['template_id'], target_server_address))
-
-                                logger.debug("Deleting template id %s on server: %s"
-                                             % (target_template_id_to_delete['template_id'], target_server_address))
-                                r = requests.delete(
-                                    base_dst_api_url + '/templates/' + target_template_id_to_delete['template_id'],
-                                    auth=(username, password))
-                                if not r.status_code == 204:
-                                    if r.status_code == 404:
-                                        logger.debug("Template did not exist before, not deleted")
-                                    else:
-                                        logger.fatal("unable to delete template")
-                                        logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                                        raise ProxyError()
-                                else:
-                                    print("#### Deleted template id %s on server: %s"
-                                          % (target_template_id_to_delete['template_id'], target_server_address))
-                            else:
-                                logger.fatal(
-                                    "Template id: %s already exists on server %s. Use --force to overwrite it"
-                                    " during import."
-                                    % (target_template_id_to_delete['template_id'], target_server_address))
-                                raise ProxyError()
-
-                    logger.debug("Importing template")
-                    # import template
-                    url = base_dst_api_url + '/templates'
-                    headers = {'content-type': 'application/json'}
-                    r = requests.post(url, auth=(username, password),
-                                      data=json.dumps(template, sort_keys=True, indent=4), verify=False,
-                                      headers=headers)
-                    if not r.status_code == 201:
-                        if r.status_code == 403:
-                            logger.fatal("Forbidden to import template on target server.")
-                            raise ProxyError()
-                        else:
-                            logger.fatal("Unable to import template on target server. Response: %s " % r.content)
-                            raise ProxyError()
+                node = settings_by_name[template['node_type']].get(template['name'])
+                if node is not None:
+                    for unsupported_setting in NODE_TYPE_SETTINGS[template['node_type']][2]:
+                        node.pop(unsupported_setting, None)
+                    template.update(node)
+
+                # old <2.2 GNS3 API used appliance_id and node_type, needs to be
+                # converted to be able to import template to 2.2
+
+                # 'appliance_id' is now 'template_id' in GNS3 2.2
+                # 'node_type' is now 'template_type' in GNS3 2.2
+                template['template_id'] = template.pop('appliance_id')
+                template['template_type'] = template.pop('node_type')
+
+                # platform could be null is old GNS3 2.1 templates, GNS3 2.2 only allows the following:
+                # None is not one of [\'aarch64\', \'alpha\', \'arm\', \'cris\', \'i386\', \'lm32\', \'m68k\',
+                # \'microblaze\', \'microblazeel\', \'mips\', \'mips64\', \'mips64el\', \'mipsel\', \'moxie\',
+                # \'or32\', \'ppc\', \'ppc64\', \'ppcemb\', \'s390x\', \'sh4\', \'sh4eb\', \'sparc\',
+                # \'sparc64\', \'tricore\', \'unicore32\', \'x86_64\', \'xtensa\', \'xtensaeb\', \'\']"
+                if 'platform' in template:
+                    if template['platform'] is None:
+                        template.pop('platform')
+
+        # target handling
+
+        # Try to find match for target server in config
+        target_server_addresses = list()
+        if len(config_servers) > 0:
+            for key in config_servers:
+                if target_server_pattern.fullmatch(key):
+                    logger.debug("Target server found: %s (%s) using provided match: %s", key, config_servers[key],
+                                 args.target_server)
+                    if key == args.source_server:
+                        logger.debug("Target server %s is the same as the source server %s . Filtered out.",
+                                     key, args.source_server)
                     else:
-                        print("#### Template %s replicated from server: %s to server: %s"
-                              % (template_name, src_server, target_server_address))
+                        target_server_addresses.append(config_servers[key])
+        else:
+            logger.fatal("No servers defined in config. Could not select target server.")
+            raise ProxyError()
 
-                else:
-                    logger.fatal("Could not get status of templates from server %s." % target_server_address)
-                    logger.debug("Status code: " + str(r.status_code) + " Text:" + r.text)
-                    raise ProxyError()
+        if len(target_server_addresses) == 0:
+            logger.fatal("No target servers found using match: %s. Could not select target server.", args.target_server)
+            raise ProxyError()
+
+        # target servers are independent of each other, handle them concurrently
+        with interruptible_executor(min(REPLICATION_WORKERS, len(target_server_addresses))) as executor:
+            # templates of the target servers, fetched once and updated while the templates are replicated
+            futures = [executor.submit(get_target_templates, target_server_address, session, backend_port)
+                       for target_server_address in target_server_addresses]
+            target_templates = {target_server_address: future.result()
+                                for target_server_address, future in zip(target_server_addresses, futures)}
+
+            for template in templates:
+                print("#### Replicating template: %s" % template['name'])
+
+            # a slow target server does not hold back replicating further templates to the other ones
+            futures = [executor.submit(replicate_templates_to_target, templates, target_server_address, src_server,
+                                       session, args, backend_port, target_templates)
+                       for target_server_address in target_server_addresses]
+            for future in futures:
+                future.result()
 
         print("Done.")
 
     except KeyboardInterrupt:
         pass
 
+    finally:
+        session.close()
+
 
 if __name__ == '__main__':
     main()